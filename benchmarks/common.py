@@ -0,0 +1,114 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : benchmarks shared tools.
+License           : GPL3
+"""
+
+import io, os, sys, time, random, subprocess, contextlib
+from typing import Callable, Dict, List
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_PATH)
+
+def make_tree(root: str, files: int, file_size: int, fan_out: int = 50) -> None:
+    payload = os.urandom(file_size)
+
+    for index in range(files):
+        directory = os.path.join(root, f'pkg_{index // fan_out:04d}')
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, f'module_{index:06d}.py'), 'wb') as file:
+            file.write(payload)
+
+def make_venv_tree(
+    root: str,
+    small_files: int = 5000,
+    large_files: int = 4,
+    large_size: int = 8 << 20,
+    seed: int = 0
+) -> Dict[str, int]:
+    """Creates a virtualenv-like tree: many small modules spread over
+    packages, a few large shared objects and the usual symbolic links."""
+    generator = random.Random(seed)
+    site_packages = os.path.join(root, 'lib', 'python3.11', 'site-packages')
+    total_bytes = 0
+
+    for index in range(small_files):
+        package = os.path.join(site_packages, f'package_{index % 97:02d}', f'sub_{index % 7}')
+        os.makedirs(package, exist_ok=True)
+
+        size = generator.randint(512, 16384)
+        with open(os.path.join(package, f'module_{index:06d}.py'), 'wb') as file:
+            file.write(generator.randbytes(size))
+        total_bytes += size
+
+    for index in range(large_files):
+        with open(os.path.join(site_packages, f'_native_{index}.so'), 'wb') as file:
+            file.write(generator.randbytes(large_size))
+        total_bytes += large_size
+
+    os.makedirs(os.path.join(root, 'bin'), exist_ok=True)
+    with open(os.path.join(root, 'bin', 'python3'), 'wb') as file:
+        file.write(b'#!/bin/sh\n')
+    os.symlink('python3', os.path.join(root, 'bin', 'python'))
+    os.symlink('lib', os.path.join(root, 'lib64'))
+
+    return {'files': small_files + large_files + 1, 'bytes': total_bytes}
+
+def touch_files(root: str, count: int) -> None:
+    """Rewrites `count` modules of a venv-like tree, as a failed update would."""
+    touched = 0
+
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if touched == count: return
+            if not name.endswith('.py'): continue
+
+            os.remove(os.path.join(directory, name))
+            with open(os.path.join(directory, name), 'wb') as file:
+                file.write(b'changed')
+            touched += 1
+
+def edit_files_in_place(root: str, count: int) -> Dict[str, bytes]:
+    """Overwrites `count` modules without replacing them, as an editor or
+    `echo >` does. Returns their previous content."""
+    previous = {}
+
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if len(previous) == count: return previous
+            if not name.endswith('.py'): continue
+
+            path = os.path.join(directory, name)
+            with open(path, 'r+b') as file:
+                previous[path] = file.read()
+                file.seek(0)
+                file.write(b'edited in place')
+                file.truncate()
+
+    return previous
+
+def git_commit() -> str|None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPOSITORY_PATH, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def measure(callback: Callable[[], object], repeat: int = 1, setup: Callable[[], object]|None = None) -> List[float]:
+    """Runs `callback` `repeat` times, output silenced, and returns the
+    wall time of each run. `setup` runs untimed before each run."""
+    durations = []
+
+    for _ in range(repeat):
+        if setup: setup()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            callback()
+            durations.append(time.perf_counter() - start)
+
+    return durations
@@ -0,0 +1,58 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : shell vs native file system backends benchmark.
+License           : GPL3
+
+Usage:
+- python benchmarks/fs_backends.py --files 5000 --repeat 3
+"""
+
+import os, time, shutil, argparse, tempfile
+from common import make_tree
+from vixen_lib.tools import fs
+
+def measure(backend: fs.Backend, source: str, workspace: str) -> dict:
+    fs.set_backend(backend)
+    target = os.path.join(workspace, backend.value)
+    copied = os.path.join(target, os.path.basename(source))
+    fs.create(target, fs.FileType.DIRECTORY)
+
+    start = time.perf_counter()
+    if not fs.copy(source, target): raise RuntimeError(f'{backend.value} copy failed')
+    copy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if not fs.remove(copied): raise RuntimeError(f'{backend.value} remove failed')
+    remove_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for index in range(200):
+        fs.create(os.path.join(target, f'touched_{index}'))
+    create_time = (time.perf_counter() - start) / 200
+
+    shutil.rmtree(target)
+    return {'copy': copy_time, 'remove': remove_time, 'create': create_time}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='File system backends benchmark.')
+    parser.add_argument('--files', type=int, default=5000, help='Number of files in the tree.')
+    parser.add_argument('--size', type=int, default=4096, help='Size of each file in bytes.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per backend.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='vixen_bench_') as workspace:
+        source = os.path.join(workspace, 'tree')
+        make_tree(source, args.files, args.size)
+
+        print(f'{args.files} files of {args.size} bytes, best of {args.repeat} runs\n')
+        print(f"{'backend':<8} {'copy (s)':>10} {'remove (s)':>11} {'create (ms)':>12}")
+
+        for backend in fs.Backend:
+            runs = [measure(backend, source, workspace) for _ in range(args.repeat)]
+            best = {key: min(run[key] for run in runs) for key in runs[0]}
+            print(
+                f"{backend.value:<8} {best['copy']:>10.3f} "
+                f"{best['remove']:>11.3f} {best['create'] * 1000:>12.3f}"
+            )
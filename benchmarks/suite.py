@@ -0,0 +1,219 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : snapshots, file system and state benchmark suite.
+License           : GPL3
+
+Usage:
+- python benchmarks/suite.py --output bench.json
+- python benchmarks/suite.py --compare bench.json
+"""
+
+import os, time, json, shutil, argparse, platform, statistics, tempfile
+from typing import Dict, List
+from common import make_venv_tree, touch_files, edit_files_in_place, git_commit, measure
+from vixen_lib.packages import state
+from vixen_lib.snapshots import SnapShot, SnapMode
+from vixen_lib.tools import fs, json as vixen_json
+
+def summarize(durations: List[float], tree: Dict[str, int]|None = None) -> dict:
+    result = {
+        'best': min(durations),
+        'median': statistics.median(durations),
+        'runs': len(durations)
+    }
+
+    if tree:
+        result['files_per_s'] = tree['files'] / result['best']
+        result['mb_per_s'] = tree['bytes'] / (1 << 20) / result['best']
+
+    return result
+
+def bench_fs_copy(workspace: str, venv: str, tree: dict, repeat: int, workers: List[int]) -> dict:
+    results = {}
+    target = os.path.join(workspace, 'copy')
+    default_workers = fs.get_copy_workers()
+    runs = [(fs.Backend.SHELL, None)] + [(fs.Backend.NATIVE, count) for count in workers]
+
+    for backend, count in runs:
+        fs.set_backend(backend)
+        if count: fs.set_copy_workers(count)
+
+        durations = measure(
+            lambda: fs.copy(venv, target),
+            repeat,
+            setup=lambda: shutil.rmtree(target, ignore_errors=True)
+        )
+        name = f'{backend.value}, {count} workers' if count else backend.value
+        results[f'fs.copy[{name}]'] = summarize(durations, tree)
+
+    fs.set_backend(fs.Backend.NATIVE)
+    fs.set_copy_workers(default_workers)
+    shutil.rmtree(target, ignore_errors=True)
+    return results
+
+def bench_snapshots(venv: str, tree: dict, repeat: int, touched: int) -> dict:
+    results = {}
+
+    for mode in SnapMode:
+        create, restore, remove = [], [], []
+
+        for _ in range(repeat):
+            snapshot = SnapShot(state.SNAPSHOTS_PARENT_DIRECTORY, [venv], mode)
+            create += measure(snapshot.create)
+            touch_files(venv, touched)
+            restore += measure(snapshot.restore)
+            remove += measure(snapshot.remove)
+            time.sleep(1)
+
+        results[f'SnapShot.create[{mode.value}]'] = summarize(create, tree)
+        results[f'SnapShot.restore[{mode.value}]'] = summarize(restore)
+        results[f'SnapShot.remove[{mode.value}]'] = summarize(remove)
+
+    return results
+
+def check_in_place_rollback(venv: str, touched: int) -> None:
+    """Every mode restores files which were edited in place (no snap may
+    share their inode). Raises on the first mode which does not."""
+    for mode in SnapMode:
+        snapshot = SnapShot(state.SNAPSHOTS_PARENT_DIRECTORY, [venv], mode)
+        measure(snapshot.create)
+        previous = edit_files_in_place(venv, touched)
+        measure(snapshot.restore)
+        measure(snapshot.remove)
+
+        for path, content in previous.items():
+            with open(path, 'rb') as file:
+                if file.read() != content:
+                    raise RuntimeError(f'{mode.value} snapshot did not restore {path} edited in place')
+
+def bench_store_incremental(venv: str, tree: dict, repeat: int, touched: int) -> dict:
+    """Second STORE snapshot of a tree whose blobs are already stored."""
+    durations = []
+
+    for _ in range(repeat):
+        first = SnapShot(state.SNAPSHOTS_PARENT_DIRECTORY, [venv], SnapMode.STORE)
+        measure(first.create)
+        touch_files(venv, touched)
+        time.sleep(1)
+
+        second = SnapShot(state.SNAPSHOTS_PARENT_DIRECTORY, [venv], SnapMode.STORE)
+        durations += measure(second.create)
+        measure(second.remove)
+        measure(first.remove)
+        time.sleep(1)
+
+    return {'SnapShot.create[store, incremental]': summarize(durations, tree)}
+
+def clear_store() -> None:
+    for name in ('objects', 'manifests', 'index.json'):
+        path = os.path.join(state.SNAPSHOTS_PARENT_DIRECTORY, name)
+        if os.path.isdir(path): shutil.rmtree(path)
+        elif os.path.exists(path): os.remove(path)
+
+def bench_store_workers(venv: str, tree: dict, repeat: int, workers: List[int]) -> dict:
+    """STORE snapshot of the tree into an empty store, and its restore
+    once the tree is removed, per copy workers count."""
+    results = {}
+    default_workers = fs.get_copy_workers()
+
+    for count in workers:
+        fs.set_copy_workers(count)
+        create, restore = [], []
+
+        for _ in range(repeat):
+            clear_store()
+            snapshot = SnapShot(state.SNAPSHOTS_PARENT_DIRECTORY, [venv], SnapMode.STORE)
+            create += measure(snapshot.create)
+            shutil.rmtree(venv)
+            restore += measure(snapshot.restore)
+            measure(snapshot.remove)
+            time.sleep(1)
+
+        results[f'SnapShot.create[store, {count} workers]'] = summarize(create, tree)
+        results[f'SnapShot.restore[store, {count} workers]'] = summarize(restore, tree)
+
+    fs.set_copy_workers(default_workers)
+    return results
+
+def bench_state(iterations: int) -> dict:
+    data = {'env_path': '/opt/vixen-env', 'exec_paths': ['/usr/bin/vxm']}
+    state.create(data)
+
+    update = measure(lambda: state.update({'exec_paths': ['/usr/bin/vxm']}), iterations)
+    read = measure(state.read, iterations)
+    json_update = measure(
+        lambda: vixen_json.update(state.STATUS_PATH['path'], {'exec_paths': []}), iterations
+    )
+
+    return {
+        'state.update': summarize(update),
+        'state.read': summarize(read),
+        'json.update': summarize(json_update)
+    }
+
+def print_results(results: dict, baseline: dict|None = None) -> None:
+    header = f"{'operation':<36} {'best (s)':>10} {'median (s)':>11} {'MB/s':>9}"
+    if baseline: header += f" {'base (s)':>10} {'ratio':>7}"
+    print(header)
+
+    for name, result in results.items():
+        line = f"{name:<36} {result['best']:>10.4f} {result['median']:>11.4f} "
+        line += f"{result['mb_per_s']:>9.1f}" if 'mb_per_s' in result else f"{'':>9}"
+
+        if baseline and name in baseline:
+            base = baseline[name]['best']
+            line += f" {base:>10.4f} {result['best'] / base:>7.2f}"
+
+        print(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vixen environment benchmark suite.')
+    parser.add_argument('--files', type=int, default=5000, help='Number of small files in the venv tree.')
+    parser.add_argument('--large-files', type=int, default=4, help='Number of 8 MB files in the venv tree.')
+    parser.add_argument('--touched', type=int, default=20, help='Files changed before each restore.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per snapshot and copy operation.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, fs.get_copy_workers()], help='Copy workers counts to compare (fs.copy and STORE snapshots).')
+    parser.add_argument('--iterations', type=int, default=200, help='Runs per state operation.')
+    parser.add_argument('--directory', type=str, help='Work directory (defaults to a temporary directory).')
+    parser.add_argument('--output', type=str, help='Write the results to a JSON file.')
+    parser.add_argument('--compare', type=str, help='JSON results of a previous run to compare with.')
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix='vixen_bench_', dir=args.directory)
+
+    try:
+        state.set_parent_directory(os.path.join(workspace, 'var'))
+        state.create_directory()
+
+        venv = os.path.join(workspace, 'opt', 'vixen-env')
+        tree = make_venv_tree(venv, args.files, args.large_files)
+
+        check_in_place_rollback(venv, args.touched)
+
+        results = {}
+        results.update(bench_fs_copy(workspace, venv, tree, args.repeat, sorted(set(args.workers))))
+        results.update(bench_snapshots(venv, tree, args.repeat, args.touched))
+        results.update(bench_store_incremental(venv, tree, args.repeat, args.touched))
+        results.update(bench_store_workers(venv, tree, args.repeat, sorted(set(args.workers))))
+        results.update(bench_state(args.iterations))
+    finally: shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'results': results
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file: baseline = json.load(file)['results']
+
+    print(f"commit {report['commit']}, {tree['files']} files, {tree['bytes'] / (1 << 20):.1f} MB\n")
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as file: json.dump(report, file, indent=4)
@@ -0,0 +1,78 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : venv template clone benchmark.
+License           : GPL3
+
+Usage:
+- python benchmarks/venv_template.py --repeat 3
+"""
+
+import os, time, shutil, argparse, tempfile, subprocess
+from common import measure
+from vixen_lib.packages.venv import VenvTemplate, TEMPLATE_FILE_NAME
+from vixen_lib.tools import fs, json
+
+def make_template(template: VenvTemplate) -> float:
+    """Bootstraps the template as `VenvTemplate.build` does, without the
+    pip upgrade so the benchmark runs offline. Returns its duration."""
+    start = time.perf_counter()
+    subprocess.run([template.python, '-m', 'venv', template.path], check=True)
+    duration = time.perf_counter() - start
+
+    template._remove_bytecode(template.path)
+    json.write(f'{template.path}/{TEMPLATE_FILE_NAME}', {
+        'prefix': template.path,
+        'python': template.python
+    })
+    return duration
+
+def clone_method(directory: str) -> str:
+    """How `VenvTemplate.clone` copies files in `directory`."""
+    probe = os.path.join(directory, '.probe')
+    with open(probe, 'wb') as file: file.write(b'probe')
+
+    cloner = fs.Cloner(hardlink=False)
+    cloner(probe, f'{probe}.clone')
+    os.remove(probe)
+    os.remove(f'{probe}.clone')
+    return cloner.method.value
+
+def tree_size(path: str) -> tuple:
+    files, size = 0, 0
+
+    for directory, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.lstat(os.path.join(directory, name)).st_size
+
+    return files, size
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Venv template clone benchmark.')
+    parser.add_argument('--python', type=str, help='Interpreter of the template (defaults to the current one).')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per clone.')
+    parser.add_argument('--directory', type=str, help='Work directory (defaults to a temporary directory).')
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix='vixen_bench_', dir=args.directory)
+
+    try:
+        template = VenvTemplate(args.python, os.path.join(workspace, 'templates'))
+        os.makedirs(template.directory)
+        bootstrap = make_template(template)
+        files, size = tree_size(template.path)
+        method = clone_method(template.directory)
+
+        target = os.path.join(workspace, 'venv')
+        reset = lambda: shutil.rmtree(target, ignore_errors=True)
+        clone = measure(lambda: template.clone(target), args.repeat, setup=reset)
+        hardlink = measure(lambda: fs.clone(template.path, target, hardlink=True), args.repeat, setup=reset)
+    finally: shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f'{files} files, {size / (1 << 20):.1f} MB, clones by {method}, best of {args.repeat} runs\n')
+    print(f"{'operation':<28} {'best (s)':>10}")
+    print(f"{'python -m venv':<28} {bootstrap:>10.4f}")
+    print(f"{'VenvTemplate.clone':<28} {min(clone):>10.4f}")
+    print(f"{'fs.clone[hardlink]':<28} {min(hardlink):>10.4f}")
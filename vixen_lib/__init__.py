@@ -6,6 +6,12 @@ Description       : vixen environment library.
 License           : GPL3
 """
 
-from . import packages
-from . import snapshots
-from . import tools
\ No newline at end of file
+import importlib
+
+# Subpackages are imported on first access, so that `vxm` only loads
+# what the requested operation uses.
+__all__ = ['packages', 'snapshots', 'tools']
+
+def __getattr__(name: str):
+    if name in __all__: return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
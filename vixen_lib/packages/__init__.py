@@ -6,5 +6,17 @@ Description       : vixen packages management.
 License           : GPL3
 """
 
-from .core import Setup
-from .state import State
\ No newline at end of file
+import importlib
+
+EXPORTS = {
+    'Setup': 'core',
+    'State': 'state',
+    'Transaction': 'transaction'
+}
+__all__ = list(EXPORTS) + ['state', 'loader', 'operations', 'client']
+
+def __getattr__(name: str):
+    if name in EXPORTS:
+        return getattr(importlib.import_module(f'.{EXPORTS[name]}', __name__), name)
+    if name in __all__: return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,89 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages requirements cache.
+License           : GPL3
+"""
+
+import os, time, hashlib, threading
+from typing import Callable, Dict, List
+from ..tools import fs, json
+
+REQUIREMENTS_CACHE_PATH = '/var/opt/vixen/requirements_cache.json'
+
+def signature(paths: List[str], env: List[str]) -> str:
+    """Invalidation key of a cached result: the (mtime, size, inode) of
+    each path and the value of each environment variable."""
+    digest = hashlib.sha256()
+
+    for path in paths:
+        try:
+            path_stat = os.stat(path)
+            digest.update(
+                f'{path}:{path_stat.st_mtime_ns}:{path_stat.st_size}:{path_stat.st_ino}'.encode()
+            )
+        except FileNotFoundError: digest.update(f'{path}:missing'.encode())
+
+    for name in env:
+        digest.update(f'{name}={os.environ.get(name)}'.encode())
+
+    return digest.hexdigest()
+
+class RequirementsCache:
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._entries: Dict[str, dict]|None = None
+        self._is_dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._entries = (fs.exists(self._path) and json.read(self._path)) or {}
+        return self._entries
+
+    def reload(self) -> None:
+        """Drops the entries in memory, the next access reads the file."""
+        with self._lock:
+            self._entries = None
+            self._is_dirty = False
+
+    def get(self, key: str, key_signature: str, ttl: float|None = None) -> bool|None:
+        with self._lock:
+            entry = self.entries.get(key)
+
+        if not entry or entry['signature'] != key_signature: return None
+        if ttl is not None and time.time() - entry['time'] > ttl: return None
+        return entry['result']
+
+    def set(self, key: str, key_signature: str, result: bool) -> None:
+        with self._lock:
+            self.entries[key] = {
+                'signature': key_signature,
+                'result': result,
+                'time': time.time()
+            }
+            self._is_dirty = True
+
+    def evaluate(self, key: str, options: dict, callback: Callable[[], bool]) -> bool:
+        key_signature = signature(options.get('paths', []), options.get('env', []))
+        result = self.get(key, key_signature, options.get('ttl'))
+
+        if result is None:
+            result = callback()
+            self.set(key, key_signature, result)
+
+        return result
+
+    def save(self) -> bool:
+        if not self._is_dirty: return True
+        if not fs.exists(os.path.dirname(self._path)): return False
+
+        with self._lock:
+            if not json.write(self._path, self.entries): return False
+            self._is_dirty = False
+
+        return True
+
+requirements_cache = RequirementsCache(REQUIREMENTS_CACHE_PATH)
@@ -0,0 +1,86 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vxm daemon client.
+License           : GPL3
+"""
+
+import os, sys, json, struct, socket
+from typing import Iterator, Tuple
+
+DAEMON_SOCKET_ENV_VAR = 'VIXEN_DAEMON_SOCKET'
+DAEMON_SOCKET_PATH = os.environ.get(DAEMON_SOCKET_ENV_VAR, '/run/vixen/vxm.sock')
+FRAME_HEADER = struct.Struct('!cI')
+READ_SIZE = 1 << 16
+
+class FrameType:
+    OUTPUT: bytes = b'o'
+    EXIT: bytes = b'x'
+
+def frame(frame_type: bytes, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+def read_frames(connection: socket.socket) -> Iterator[Tuple[bytes, bytes]]:
+    """(type, payload) of every frame received, up to the end of the
+    connection. A truncated last frame is dropped."""
+    buffer = b''
+
+    while chunk := connection.recv(READ_SIZE):
+        buffer += chunk
+
+        while len(buffer) >= FRAME_HEADER.size:
+            frame_type, size = FRAME_HEADER.unpack_from(buffer)
+            end = FRAME_HEADER.size + size
+            if len(buffer) < end: break
+
+            yield frame_type, buffer[FRAME_HEADER.size:end]
+            buffer = buffer[end:]
+
+class RequestType:
+    OPERATIONS: str = 'operations'
+    COLLECT_SNAPSHOTS: str = 'collect_snapshots'
+    STATUS: str = 'status'
+    RESUME: str = 'resume'
+    ROLLBACK: str = 'rollback'
+    EXPORT_IMAGE: str = 'export_image'
+    IMPORT_IMAGE: str = 'import_image'
+
+def connect(socket_path: str = DAEMON_SOCKET_PATH) -> socket.socket|None:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try: connection.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError, PermissionError):
+        connection.close()
+        return None
+
+    return connection
+
+def request(data: dict, socket_path: str = DAEMON_SOCKET_PATH) -> int|None:
+    """Sends a request to the daemon and streams the job output to the
+    terminal. Returns the exit code of the job, None when no daemon is
+    listening.
+
+    The daemon sends length prefixed frames: the job output, then the
+    JSON result. Output bytes can't be taken for the end of the job.
+    """
+    connection = connect(socket_path)
+    if not connection: return None
+
+    result = None
+
+    with connection:
+        connection.sendall(json.dumps(data).encode() + b'\n')
+
+        for frame_type, payload in read_frames(connection):
+            if frame_type == FrameType.EXIT:
+                result = payload
+                break
+
+            sys.stdout.buffer.write(payload)
+            sys.stdout.buffer.flush()
+
+    try: return json.loads(result)['exit']
+    except (TypeError, ValueError, KeyError):
+        print('vxm daemon : connection closed before the end of the job', file=sys.stderr)
+        return 1
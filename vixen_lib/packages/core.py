@@ -6,20 +6,27 @@ Description       : vixen packages management.
 License           : GPL3
 """
 
-from typing import Optional, Callable, List
+import time
+from typing import Optional, Callable, Dict, List
+from concurrent.futures import ThreadPoolExecutor
 from .state import State
-from ..tools import cli
+from .scheduler import Scheduler, DEFAULT_MAX_WORKERS
+from .cache import requirements_cache
+from .journal import journal
+from ..tools import cli, fs, bytecode, fingerprint, trace
 
 class Requirement:
     def __init__(
         self,
         purpose: str,
         callback: Callable[[], bool],
-        failure_msg: Optional[str|None] = None
+        failure_msg: Optional[str|None] = None,
+        cache: Optional[dict|None] = None
     ) -> None:
         self._purpose = purpose
         self._callback = callback
         self._failure_msg = failure_msg
+        self._cache = cache
 
     def _show_check_msg(self, success: bool) -> None:
         msg = cli.CheckMsg(self._purpose)
@@ -30,12 +37,22 @@ class Requirement:
         msg = f" : {self._failure_msg}" if self._failure_msg else ''
         print(f"\n{prompt}{msg}")
 
-    def is_satisfied(self) -> bool:
-        result = self._callback()
+    def evaluate(self) -> bool:
+        with trace.tracer.span(self._purpose, 'requirement'):
+            if self._cache is None: return self._callback()
+
+            return requirements_cache.evaluate(
+                self._cache.get('key', self._purpose), self._cache, self._callback
+            )
+
+    def report(self, result: bool) -> bool:
         self._show_check_msg(result)
         if not result: self._show_failure_msg()
         return result
 
+    def is_satisfied(self) -> bool:
+        return self.report(self.evaluate())
+
 def data_to_requirements(
     requirements_data: Optional[List[dict]|None]
 ) -> List[Requirement]:
@@ -45,7 +62,8 @@ def data_to_requirements(
         Requirement(
             purpose=data['purpose'],
             callback=data['callback'],
-            failure_msg=data.get('failure_details')
+            failure_msg=data.get('failure_details'),
+            cache=data.get('cache')
         ) for data in requirements_data
     ]
 
@@ -53,70 +71,233 @@ class Task:
     def __init__(
             self,
             purpose: str,
-            cmd: str,
-            requirements: List[Requirement] = []
+            cmd: str|Callable[[], str]|None,
+            requirements: List[Requirement] = [],
+            depends_on: Optional[List[str]|None] = None,
+            provides: List[str] = [],
+            name: Optional[str|None] = None,
+            inputs: List[str] = [],
+            outputs: List[str] = [],
+            fingerprint_method: fingerprint.Method = fingerprint.Method.STAT,
+            timeout: Optional[float|None] = None,
+            source: Optional[str|None] = None,
+            callback: Optional[Callable[[], bool]|None] = None
     ) -> None:
         self._purpose = purpose
         self._cmd = cmd
+        self._callback = callback
         self._requirements = requirements
         self._is_done = False
+        self.depends_on = depends_on
+        self.provides = provides
+        self.name = name or purpose
+        self._inputs = inputs
+        self._outputs = outputs
+        self._fingerprint_method = fingerprint_method
+        self.recorded_fingerprint: str|None = None
+        self._timeout = timeout
+        self._source = source
+        self.result: cli.Result|None = None
+        self.setup_index = 0
+        self.is_resumed = False
     
     @property
     def is_done(self) -> bool:
         return self._is_done
+
+    @property
+    def is_tracked(self) -> bool:
+        return bool(self._inputs)
+
+    def fingerprint(self) -> str:
+        inputs = fingerprint.fingerprint(self._inputs, self._fingerprint_method)
+        outputs = fingerprint.fingerprint(self._outputs, self._fingerprint_method)
+        return f'{inputs}:{outputs}'
+
+    @property
+    def is_up_to_date(self) -> bool:
+        if not self.is_tracked or not self.recorded_fingerprint: return False
+        return self.recorded_fingerprint == self.fingerprint()
     
     def _show_check_msg(self, success: bool) -> None:
         msg = cli.CheckMsg(self._purpose)
         print(msg.success if success else msg.failure)
 
+    def _show_up_to_date_msg(self) -> None:
+        print(f"{self._purpose} : {cli.TypedMsg('up to date').warning}")
+
+    def _show_resumed_msg(self) -> None:
+        print(f"{self._purpose} : {cli.TypedMsg('done before interruption').warning}")
+
     def _check_requirements(self) -> bool:
-        return all(
-            requirement.is_satisfied() for requirement in self._requirements
-        )
+        if len(self._requirements) < 2:
+            result = all(
+                requirement.is_satisfied() for requirement in self._requirements
+            )
+        else:
+            with ThreadPoolExecutor(max_workers=len(self._requirements)) as executor:
+                results = list(executor.map(Requirement.evaluate, self._requirements))
+
+            result = all(
+                requirement.report(result)
+                for requirement, result in zip(self._requirements, results)
+            )
+
+        requirements_cache.save()
+        return result
+
+    def _show_timeout_msg(self) -> None:
+        prompt = cli.TypedMsg(f'Timed out after {self._timeout}s').failure
+        print(f"{self._purpose} : {prompt}")
+
+    def _execute_callback(self) -> cli.Result:
+        start = time.perf_counter()
+        errors = []
+
+        try: success = bool(self._callback())
+        except Exception as error:
+            print(error)
+            success, errors = False, [str(error)]
+
+        return cli.Result(self._purpose, 0 if success else 1, time.perf_counter() - start, [], errors)
 
     def _process(self) -> bool:
-        self._is_done = cli.run(self._cmd)
+        if self._callback: self.result = self._execute_callback()
+        else:
+            # A callable command is only built when the task runs.
+            cmd = self._cmd() if callable(self._cmd) else self._cmd
+            self.result = cli.execute(cmd, timeout=self._timeout, source=self._source)
+        self._is_done = self.result.success
+
+        if self.result.timed_out: self._show_timeout_msg()
         self._show_check_msg(self._is_done)
         return self._is_done
         
     def run(self) -> bool:
-        return self._process() if self._check_requirements() else False
+        with trace.tracer.span(self._purpose, 'task'):
+            if self.is_up_to_date:
+                self._show_up_to_date_msg()
+                return True
+
+            if self.is_resumed:
+                self._show_resumed_msg()
+                self._is_done = True
+                return True
+
+            if not self._check_requirements(): return False
+            if not journal.task_started(self.setup_index, self.name): return False
+            return self._process() and journal.task_done(self.setup_index, self.name)
+
+def data_to_keys(keys_data: Optional[str|List[str]|None]) -> List[str]|None:
+    if keys_data is None: return None
+    return [keys_data] if isinstance(keys_data, str) else list(keys_data)
 
 def data_to_task(task_data: dict) -> Task:
     return Task(
         purpose=task_data['purpose'],
-        cmd=task_data['process_command'],
-        requirements=data_to_requirements(task_data.get('requirements'))
+        cmd=task_data.get('process_command'),
+        requirements=data_to_requirements(task_data.get('requirements')),
+        depends_on=data_to_keys(task_data.get('depends_on')),
+        provides=data_to_keys(task_data.get('provides')) or [],
+        name=task_data.get('name'),
+        inputs=data_to_keys(task_data.get('inputs')) or [],
+        outputs=data_to_keys(task_data.get('outputs')) or [],
+        fingerprint_method=fingerprint.Method(task_data.get('fingerprint', 'stat')),
+        timeout=task_data.get('timeout'),
+        source=task_data.get('source'),
+        callback=task_data.get('process_callback')
     )
 
 class Setup:
-    def __init__(self, data: dict) -> None:
+    def __init__(
+        self,
+        data: dict,
+        state: Optional[State|None] = None,
+        index: int = 0
+    ) -> None:
         self._tasks: List[Task] = []
+        self._index = index
         self._purpose: str = data['purpose']
+        self._max_workers: int = data.get('max_workers', DEFAULT_MAX_WORKERS)
+        self._feature: dict|None = data.get('feature')
+        self._is_removal: bool = data.get('operation') == 'remove'
+        self._compile: dict|None = data.get('compile')
 
         print(f'\n{cli.TypedMsg(self._purpose).title}\n')
-        
-        self._init_state(data.get('state'))
+
+        if state: self._state = state
+        else: self._init_state(data.get('state'))
+
         self._init_tasks(data['tasks'])
+        if not state: self._init_snapshot()
 
     def _init_state(self, new_data: Optional[dict|None]):
-        self._state = State(new_data)
+        self._state = State(new_data, self._feature, self._is_removal)
         if not self._state.init(): self._finalize(False)
-        if not self._state.create_snapshot(): self._finalize(False)
+
+    def _init_snapshot(self):
+        if not self._state.create_snapshot(self.is_up_to_date): self._finalize(False)
 
     def _init_tasks(self, tasks_data: List[dict]):
         self._tasks = [data_to_task(data) for data in tasks_data]
+        resumed = journal.done_tasks(self._index)
+
+        for task in self._tasks:
+            task.setup_index = self._index
+            task.is_resumed = task.name in resumed
+
+        if not self._feature: return
+
+        recorded = self._state.recorded_fingerprints(self._feature['name'])
+        for task in self._tasks: task.recorded_fingerprint = recorded.get(task.name)
+
+    @property
+    def is_up_to_date(self) -> bool:
+        return bool(self._tasks) and all(task.is_up_to_date for task in self._tasks)
+
+    def _record_fingerprints(self) -> None:
+        if not self._feature: return
+
+        fingerprints: Dict[str, str] = {
+            task.name: task.fingerprint() for task in self._tasks if task.is_tracked
+        }
+        self._state.add_fingerprints(self._feature['name'], fingerprints)
     
     @property
-    def _has_done_tasks(self) -> bool:
+    def has_done_tasks(self) -> bool:
         return any(task.is_done for task in self._tasks)
+
+    def _precompile(self) -> None:
+        """Post-install stage: compiles the stale bytecode of `compile`
+        paths, so the first start after an install or update doesn't."""
+        purpose = 'Compile bytecode'
+        paths = [path for path in self._compile.get('paths', []) if fs.exists(path)]
+        mode = bytecode.InvalidationMode(self._compile.get('invalidation_mode', 'timestamp'))
+        python = self._compile.get('python')
+
+        with trace.tracer.span(purpose, 'compile'):
+            if not bytecode.is_current_interpreter(python):
+                result = cli.execute(bytecode.compileall_command(python, paths, mode))
+                details = 'compiled' if result.success else 'some files failed to compile'
+            else:
+                compiled, failed = bytecode.precompile(paths, mode, self._compile.get('workers'))
+                details = f'{compiled} compiled' + (f', {len(failed)} failed' if failed else '')
+
+        print(f"{purpose} : {cli.TypedMsg(details).warning}")
+
+    def run(self) -> bool:
+        with trace.tracer.span(self._purpose, 'setup'), cli.sessions():
+            result = Scheduler(self._tasks, self._max_workers).run()
+
+        if result and self._compile and self.has_done_tasks: self._precompile()
+        if result: self._record_fingerprints()
+        return result
     
     def process(self) -> None:
-        result = not any(not task.run() for task in self._tasks)
-        self._finalize(result)
+        self._finalize(self.run())
 
     def _finalize(self, success: bool) -> None:
-        self._state.finalize(success, self._has_done_tasks)
+        success = self._state.finalize(success, self.has_done_tasks)
 
         msg = cli.CheckMsg('Execution')
         print(msg.success if success else msg.failure)
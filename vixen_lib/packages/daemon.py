@@ -0,0 +1,352 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vxm daemon, jobs queued from a unix domain socket.
+License           : GPL3
+"""
+
+import io, os, sys, json, time, signal, socket, selectors, traceback
+from collections import deque
+from typing import Dict, List
+from . import core, transaction, operations, state # loaded once, forked jobs start with them
+from .cache import requirements_cache
+from .loader import setup_loader
+from .client import DAEMON_SOCKET_PATH, FrameType, RequestType, connect, frame
+from ..tools import cli, trace
+
+REQUEST_TIMEOUT = 5.0
+MAX_REQUEST_SIZE = 1 << 20
+REAP_INTERVAL = 0.2
+
+class ConnectionWriter(io.RawIOBase):
+    """Job output sent to the client. Once the client is gone the output
+    is dropped, so the job still runs to its end."""
+
+    def __init__(self, connection: socket.socket) -> None:
+        self._connection = connection
+        self._is_connected = True
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._is_connected:
+            try: self._connection.sendall(frame(FrameType.OUTPUT, bytes(data)))
+            except OSError: self._is_connected = False
+        return len(data)
+
+class PendingRequest:
+    """A connection whose request line is still being received."""
+
+    def __init__(self, connection: socket.socket) -> None:
+        self.connection = connection
+        self.data = b''
+        self.deadline = time.monotonic() + REQUEST_TIMEOUT
+
+    @property
+    def is_complete(self) -> bool:
+        return self.data.endswith(b'\n') or len(self.data) >= MAX_REQUEST_SIZE
+
+class Job:
+    def __init__(self, connection: socket.socket, data: dict) -> None:
+        self.connection = connection
+        self.data = data
+        self.pid: int|None = None
+        self.pidfd: int|None = None
+
+    @property
+    def is_serialized(self) -> bool:
+        return self.data.get('type') != RequestType.STATUS
+
+    def finish(self, exit_code: int) -> None:
+        try: self.connection.sendall(frame(FrameType.EXIT, json.dumps({'exit': exit_code}).encode()))
+        except OSError: pass
+        self.connection.close()
+
+REQUEST_TYPES = {value for name, value in vars(RequestType).items() if not name.startswith('_')}
+
+def _is_paths(value) -> bool:
+    return isinstance(value, list) and all(isinstance(path, str) for path in value)
+
+def _is_optional_int(value) -> bool:
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+def request_error(data) -> str|None:
+    """Why a request can't be served, None when it is valid."""
+    if not isinstance(data, dict): return 'the request is not a JSON object'
+
+    request_type = data.get('type')
+    if request_type not in REQUEST_TYPES: return f'unknown request type : {request_type}'
+    if not isinstance(data.get('profile', False), bool): return "'profile' is not a boolean"
+
+    if request_type == RequestType.OPERATIONS:
+        requested = data.get('operations')
+
+        if not isinstance(requested, dict): return "'operations' is not an object"
+        for operation, paths in requested.items():
+            if operation not in operations.OPERATIONS: return f'unknown operation : {operation}'
+            if not _is_paths(paths): return f"'{operation}' is not a list of paths"
+
+    if request_type == RequestType.COLLECT_SNAPSHOTS:
+        if not _is_optional_int(data.get('keep_last')): return "'keep_last' is not an integer"
+        if not _is_optional_int(data.get('max_bytes')): return "'max_bytes' is not an integer"
+
+    if request_type in (RequestType.EXPORT_IMAGE, RequestType.IMPORT_IMAGE):
+        if not isinstance(data.get('path'), str): return "'path' is not a string"
+
+    return None
+
+def run_request(data: dict) -> int:
+    request_type = data.get('type')
+
+    if request_type == RequestType.STATUS:
+        return 0 if operations.status() else 1
+
+    if request_type == RequestType.COLLECT_SNAPSHOTS:
+        return 0 if operations.collect_snapshots(data.get('keep_last'), data.get('max_bytes')) else 1
+
+    if request_type == RequestType.RESUME:
+        trace.tracer.profile = bool(data.get('profile'))
+        return 0 if operations.resume() else 1
+
+    if request_type == RequestType.ROLLBACK:
+        return 0 if operations.rollback() else 1
+
+    if request_type == RequestType.EXPORT_IMAGE:
+        return 0 if operations.export_image(data['path']) else 1
+
+    if request_type == RequestType.IMPORT_IMAGE:
+        return 0 if operations.import_image(data['path']) else 1
+
+    if request_type == RequestType.OPERATIONS:
+        trace.tracer.profile = bool(data.get('profile'))
+        operations.process(data.get('operations', {}))
+        return 0
+
+    print(cli.TypedMsg(f'Unknown request : {request_type}').failure)
+    return 1
+
+def exit_code(error: SystemExit) -> int:
+    if error.code is None: return 0
+    return error.code if isinstance(error.code, int) else 1
+
+class Daemon:
+    """Serves vxm requests from a unix domain socket.
+
+    The library, the packages state and the requirements cache stay
+    loaded between jobs. Each job runs in a process forked from the
+    daemon, which starts with all of it in memory and keeps the daemon
+    safe from `exit` calls and crashes of the setups. Install, update,
+    remove and snapshots collection jobs run one at a time, in arrival
+    order (with resume and rollback); status requests are answered right
+    away. Requests are read without blocking the other clients, and
+    malformed ones are rejected. The output of a job is streamed to its
+    client.
+    """
+
+    def __init__(self, socket_path: str = DAEMON_SOCKET_PATH) -> None:
+        self.socket_path = socket_path
+        self._selector = selectors.DefaultSelector()
+        self._listener: socket.socket|None = None
+        self._queue: deque[Job] = deque()
+        self._running: Dict[int, Job] = {}
+        self._pending: List[PendingRequest] = []
+        self._is_serving = False
+
+    def _listen(self) -> bool:
+        existing = connect(self.socket_path)
+        if existing:
+            existing.close()
+            print(cli.TypedMsg(f'A vxm daemon already listens on {self.socket_path}').failure)
+            return False
+
+        if os.path.lexists(self.socket_path): os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        return True
+
+    def _warm(self) -> None:
+        if state.exists(): state.read()
+        requirements_cache.reload()
+        requirements_cache.entries
+
+    def _stop(self, *_) -> None:
+        self._is_serving = False
+
+    def serve(self) -> bool:
+        if not self._listen(): return False
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self._is_serving = True
+        self._warm()
+        print(f'vxm daemon listening on {self.socket_path}')
+
+        try:
+            while self._is_serving or self._running:
+                for key, _ in self._selector.select(REAP_INTERVAL):
+                    if key.fileobj is self._listener: self._accept()
+                    elif isinstance(key.data, PendingRequest): self._receive(key.data)
+                    else: self._reap(key.data)
+
+                if not self._is_serving: self._close_listener()
+                self._expire_requests()
+                self._reap_all()
+                self._start_jobs()
+        finally:
+            self._close_listener()
+            for pending in list(self._pending): self._drop(pending)
+            for job in self._queue: job.finish(1)
+
+        return True
+
+    def _close_listener(self) -> None:
+        if not self._listener: return
+
+        self._selector.unregister(self._listener)
+        self._listener.close()
+        self._listener = None
+        if os.path.lexists(self.socket_path): os.remove(self.socket_path)
+
+    def _accept(self) -> None:
+        try: connection, _ = self._listener.accept()
+        except BlockingIOError: return
+
+        connection.setblocking(False)
+        pending = PendingRequest(connection)
+        self._pending.append(pending)
+        self._selector.register(connection, selectors.EVENT_READ, pending)
+
+    def _drop(self, pending: PendingRequest) -> None:
+        self._selector.unregister(pending.connection)
+        self._pending.remove(pending)
+        pending.connection.close()
+
+    def _expire_requests(self) -> None:
+        now = time.monotonic()
+
+        for pending in list(self._pending):
+            if now >= pending.deadline: self._drop(pending)
+
+    def _receive(self, pending: PendingRequest) -> None:
+        try: chunk = pending.connection.recv(MAX_REQUEST_SIZE - len(pending.data))
+        except BlockingIOError: return
+        except OSError: chunk = b''
+
+        if not chunk:
+            self._drop(pending)
+            return
+
+        pending.data += chunk
+        if not pending.is_complete: return
+
+        self._selector.unregister(pending.connection)
+        self._pending.remove(pending)
+        pending.connection.setblocking(True)
+
+        try:
+            data = json.loads(pending.data)
+            error = request_error(data)
+        except ValueError: data, error = None, 'the request is not valid JSON'
+
+        if error:
+            self._reject(pending.connection, error)
+            return
+
+        self._submit(Job(pending.connection, data))
+
+    def _reject(self, connection: socket.socket, error: str) -> None:
+        message = cli.TypedMsg(f'Invalid request : {error}').failure
+        try: connection.sendall(frame(FrameType.OUTPUT, f'{message}\n'.encode()))
+        except OSError: pass
+        Job(connection, {}).finish(1)
+
+    def _submit(self, job: Job) -> None:
+        if not job.is_serialized:
+            self._fork(job)
+            return
+
+        waiting = len(self._queue) + sum(running.is_serialized for running in self._running.values())
+        if waiting:
+            message = cli.TypedMsg(f'Queued behind {waiting} job(s)').warning
+            try: job.connection.sendall(frame(FrameType.OUTPUT, f'{message}\n'.encode()))
+            except OSError: pass
+
+        for paths in job.data.get('operations', {}).values():
+            for path in paths: setup_loader.prepare(path)
+
+        self._queue.append(job)
+
+    def _start_jobs(self) -> None:
+        if not self._queue: return
+        if any(job.is_serialized for job in self._running.values()): return
+        self._fork(self._queue.popleft())
+
+    def _fork(self, job: Job) -> None:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+
+        if pid == 0: self._run_child(job)
+
+        job.pid = pid
+        self._running[pid] = job
+
+        if hasattr(os, 'pidfd_open'):
+            job.pidfd = os.pidfd_open(pid)
+            self._selector.register(job.pidfd, selectors.EVENT_READ, job)
+
+    def _run_child(self, job: Job) -> None:
+        code = 1
+
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if self._listener: self._listener.close()
+
+            # The connections of the other clients, which must see their
+            # end when the daemon closes them.
+            for pending in self._pending: pending.connection.close()
+            for queued in self._queue: queued.connection.close()
+            for running in self._running.values(): running.connection.close()
+
+            output = io.TextIOWrapper(
+                io.BufferedWriter(ConnectionWriter(job.connection)),
+                encoding='utf-8',
+                errors='replace',
+                line_buffering=True
+            )
+            sys.stdout = sys.stderr = output
+            trace.tracer = trace.Tracer()
+
+            code = run_request(job.data)
+        except SystemExit as error: code = exit_code(error)
+        except BaseException: traceback.print_exc()
+        finally:
+            try: sys.stdout.flush()
+            except OSError: pass
+            os._exit(code)
+
+    def _reap(self, job: Job) -> None:
+        try: pid, status = os.waitpid(job.pid, os.WNOHANG)
+        except ChildProcessError: pid, status = job.pid, 1 << 8
+        if pid == 0: return
+
+        if job.pidfd is not None:
+            self._selector.unregister(job.pidfd)
+            os.close(job.pidfd)
+
+        del self._running[job.pid]
+        job.finish(os.waitstatus_to_exitcode(status))
+
+        if job.is_serialized: self._warm()
+
+    def _reap_all(self) -> None:
+        for job in list(self._running.values()): self._reap(job)
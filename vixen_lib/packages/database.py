@@ -0,0 +1,136 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages state database.
+License           : GPL3
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Dict, List
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_version ON features (name, version);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    feature TEXT NOT NULL REFERENCES features (name) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS paths_feature ON paths (feature);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    feature TEXT NOT NULL REFERENCES features (name) ON DELETE CASCADE,
+    task TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (feature, task)
+);
+"""
+
+class StateDatabase:
+    """Installed features and the paths they own.
+
+    Paths are the primary key of their table and features are indexed by
+    name, so ownership lookups and conflict checks are B-tree searches.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._connection: sqlite3.Connection|None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if not self._connection:
+            self._connection = sqlite3.connect(self._path)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute('PRAGMA foreign_keys = ON')
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+
+    def features(self) -> List[dict]:
+        rows = self.connection.execute(
+            'SELECT name, version, updated_at FROM features ORDER BY name'
+        )
+        return [dict(row) for row in rows]
+
+    def feature(self, name: str) -> dict|None:
+        row = self.connection.execute(
+            'SELECT name, version, updated_at FROM features WHERE name = ?', (name,)
+        ).fetchone()
+        if not row: return None
+
+        feature = dict(row)
+        feature['paths'] = [
+            path for (path,) in self.connection.execute(
+                'SELECT path FROM paths WHERE feature = ? ORDER BY path', (name,)
+            )
+        ]
+        return feature
+
+    def owner(self, path: str) -> str|None:
+        row = self.connection.execute(
+            'SELECT feature FROM paths WHERE path = ?', (path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def conflicts(self, name: str, paths: List[str]) -> Dict[str, str]:
+        conflicts = {}
+
+        for path in set(paths):
+            owner = self.owner(path)
+            if owner and owner != name: conflicts[path] = owner
+
+        return conflicts
+
+    def fingerprints(self, name: str) -> Dict[str, str]:
+        return dict(self.connection.execute(
+            'SELECT task, fingerprint FROM fingerprints WHERE feature = ?', (name,)
+        ))
+
+    def register(
+        self,
+        name: str,
+        version: str,
+        paths: List[str],
+        fingerprints: Dict[str, str] = {}
+    ) -> bool:
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT INTO features (name, version, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET '
+                    'version = excluded.version, updated_at = excluded.updated_at',
+                    (name, version, datetime.now().isoformat(timespec='seconds'))
+                )
+                self.connection.executemany(
+                    'INSERT INTO paths (path, feature) VALUES (?, ?) '
+                    'ON CONFLICT (path) DO UPDATE SET feature = excluded.feature',
+                    [(path, name) for path in set(paths)]
+                )
+                self.connection.executemany(
+                    'INSERT INTO fingerprints (feature, task, fingerprint) VALUES (?, ?, ?) '
+                    'ON CONFLICT (feature, task) DO UPDATE SET fingerprint = excluded.fingerprint',
+                    [(name, task, value) for task, value in fingerprints.items()]
+                )
+            return True
+        except sqlite3.Error as error: print(error)
+
+        return False
+
+    def unregister(self, name: str) -> bool:
+        try:
+            with self.connection:
+                self.connection.execute('DELETE FROM features WHERE name = ?', (name,))
+            return True
+        except sqlite3.Error as error: print(error)
+
+        return False
@@ -0,0 +1,427 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen prebuilt environment images.
+License           : GPL3
+"""
+
+import os, io, sys, json, shutil, tarfile, hashlib, threading, subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+from . import state
+from ..snapshots.archive import COMPRESSORS, find_compressor, member_name
+from ..tools import fs, cli, trace
+
+IMAGE_FORMAT = 1
+HEADER_NAME = 'vixen-image.json'
+CHECKSUM_EXTENSION = 'sha256'
+CHUNK_SIZE = 1 << 20
+INLINE_FILE_SIZE = 8 << 20
+PENDING_FILES_PER_WORKER = 8
+MAGIC_NUMBERS = {
+    'zstd': b'\x28\xb5\x2f\xfd',
+    'xz': b'\xfd7zXZ\x00'
+}
+
+def checksum_path(path: str) -> str:
+    return f'{path}.{CHECKSUM_EXTENSION}'
+
+class HashingFile(io.RawIOBase):
+    """Binary file hashed as it is read or written."""
+
+    def __init__(self, file) -> None:
+        self._file = file
+        self.hash = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = self._file.readinto(buffer)
+        if size: self.hash.update(memoryview(buffer)[:size])
+        return size
+
+    def write(self, data) -> int:
+        self.hash.update(data)
+        return self._file.write(data)
+
+    def drain(self) -> None:
+        while self.read(CHUNK_SIZE): pass
+
+def _pump(source, destination) -> None:
+    try:
+        while chunk := source.read(CHUNK_SIZE): destination.write(chunk)
+    except BrokenPipeError: pass
+    finally:
+        try: destination.close()
+        except BrokenPipeError: pass
+
+class ImageWriter:
+    """Packs the environment, the executables and the packages state into
+    one compressed tar stream, with its SHA-256 next to it."""
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.abspath(path)
+        self._compressor = find_compressor()
+
+    def _header(self, status: dict) -> bytes:
+        features = []
+
+        for feature in state.database.features():
+            record = state.database.feature(feature['name'])
+            record['fingerprints'] = state.database.fingerprints(feature['name'])
+            features.append(record)
+
+        return json.dumps({
+            'format': IMAGE_FORMAT,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'status': status,
+            'features': features,
+            'entries': [status['env_path']] + status['exec_paths']
+        }, indent=4).encode()
+
+    def _add_header(self, tar: tarfile.TarFile, header: bytes) -> None:
+        info = tarfile.TarInfo(HEADER_NAME)
+        info.size = len(header)
+        info.mtime = int(datetime.now().timestamp())
+        tar.addfile(info, io.BytesIO(header))
+
+    def _add_entries(self, tar: tarfile.TarFile, entries: List[str]) -> None:
+        for entry in entries:
+            with trace.tracer.span(f'Image.add {entry}', 'image'):
+                tar.add(entry, arcname=member_name(entry))
+
+    def write(self, status: dict) -> bool:
+        header = self._header(status)
+        entries = json.loads(header)['entries']
+        missing = [entry for entry in entries if not os.path.lexists(entry)]
+
+        if missing:
+            print(cli.TypedMsg(f"Missing paths : {', '.join(missing)}").failure)
+            return False
+
+        with open(self.path, 'wb') as output:
+            hashing = HashingFile(output)
+
+            if not self._compressor:
+                with tarfile.open(fileobj=hashing, mode='w|xz', format=tarfile.PAX_FORMAT) as tar:
+                    self._add_header(tar, header)
+                    self._add_entries(tar, entries)
+            else:
+                process = subprocess.Popen(
+                    COMPRESSORS[self._compressor]['compress'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE
+                )
+                writer = threading.Thread(target=_pump, args=(process.stdout, hashing))
+                writer.start()
+
+                try:
+                    with tarfile.open(fileobj=process.stdin, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                        self._add_header(tar, header)
+                        self._add_entries(tar, entries)
+                finally:
+                    process.stdin.close()
+                    writer.join()
+
+                if process.wait() != 0: return False
+
+        with open(checksum_path(self.path), 'w') as file:
+            file.write(f'{hashing.hash.hexdigest()}  {os.path.basename(self.path)}\n')
+
+        return True
+
+class ImageReader:
+    """Unpacks an image written by `ImageWriter` on a fresh machine.
+
+    The checksum of the image is verified before anything is written.
+    The files then come out of the tar stream to a pool of writer
+    threads, next to the final path of their entry, and are only moved
+    into place once every member was extracted (and the image hashed
+    the same again). Symbolic and hard links are created last, so no
+    member is written through a link, and a member whose parent resolves
+    outside of its entry is refused.
+    """
+
+    def __init__(self, path: str, workers: int = 0) -> None:
+        self.path = os.path.abspath(path)
+        self._workers = workers or fs.get_copy_workers()
+        self._staging: Dict[str, str] = {}
+        self._directories: List[Tuple[str, tarfile.TarInfo]] = []
+        self._links: List[Tuple[str, str]] = []
+        self._symlinks: List[Tuple[str, tarfile.TarInfo]] = []
+        self._parents: Set[str] = set()
+        self._errors: List[str] = []
+        self._pending = threading.BoundedSemaphore(self._workers * PENDING_FILES_PER_WORKER)
+
+    def expected_checksum(self) -> str|None:
+        try:
+            with open(checksum_path(self.path), 'r') as file: return file.read().split()[0]
+        except (OSError, IndexError): return None
+
+    def _compressor(self) -> str|None:
+        """The external decompressor of the image, None for the xz
+        implementation of the standard library."""
+        with open(self.path, 'rb') as file: magic = file.read(8)
+
+        for name, magic_number in MAGIC_NUMBERS.items():
+            if magic.startswith(magic_number) and shutil.which(COMPRESSORS[name]['decompress'][0]):
+                return name
+        return None
+
+    def checksum(self) -> str:
+        image_hash = hashlib.sha256()
+
+        with open(self.path, 'rb') as file:
+            while chunk := file.read(CHUNK_SIZE): image_hash.update(chunk)
+
+        return image_hash.hexdigest()
+
+    def _staging_path(self, name: str) -> str|None:
+        path = os.path.normpath(f'/{name}')
+
+        for entry, staging in self._staging.items():
+            if path == entry: return staging
+            if path.startswith(f'{entry}/'): return staging + path[len(entry):]
+
+        return None
+
+    def _is_contained(self, path: str) -> bool:
+        """`path` is a staging entry, or its parent resolves within one."""
+        parent = os.path.dirname(path)
+        if parent in self._parents or path in self._staging.values(): return True
+
+        real_parent = os.path.realpath(parent)
+        is_contained = any(
+            real_parent == staging or real_parent.startswith(f'{staging}/')
+            for staging in map(os.path.realpath, self._staging.values())
+        )
+
+        if is_contained: self._parents.add(parent)
+        return is_contained
+
+    def _create(self, path: str):
+        return os.fdopen(
+            os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600), 'wb'
+        )
+
+    def _set_attributes(self, path: str, member: tarfile.TarInfo) -> None:
+        if os.geteuid() == 0: os.lchown(path, member.uid, member.gid)
+        if not member.issym(): os.chmod(path, member.mode)
+        os.utime(path, (member.mtime, member.mtime), follow_symlinks=False)
+
+    def _write_file(self, path: str, member: tarfile.TarInfo, data: bytes) -> None:
+        try:
+            with self._create(path) as file: file.write(data)
+            self._set_attributes(path, member)
+        except OSError as error: self._errors.append(f'{path} : {error}')
+        finally: self._pending.release()
+
+    def _extract(self, tar: tarfile.TarFile, member: tarfile.TarInfo, executor: ThreadPoolExecutor) -> None:
+        path = self._staging_path(member.name)
+
+        if path is None:
+            self._errors.append(f'{member.name} : outside of the image entries')
+            return
+
+        if not self._is_contained(path):
+            self._errors.append(f'{member.name} : parent outside of the image entries')
+            return
+
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            self._directories.append((path, member))
+        elif member.issym():
+            self._symlinks.append((path, member))
+        elif member.islnk():
+            target = self._staging_path(member.linkname)
+            if target is None: self._errors.append(f'{member.name} : link outside of the image entries')
+            else: self._links.append((target, path))
+        elif member.isfile():
+            source = tar.extractfile(member)
+
+            if member.size > INLINE_FILE_SIZE:
+                with self._create(path) as file: shutil.copyfileobj(source, file, CHUNK_SIZE)
+                self._set_attributes(path, member)
+                return
+
+            data = source.read()
+            self._pending.acquire()
+            executor.submit(self._write_file, path, member, data)
+        else:
+            self._errors.append(f'{member.name} : unsupported member type')
+
+    def _finish(self) -> None:
+        for target, path in self._links:
+            try: os.link(target, path, follow_symlinks=False)
+            except OSError as error: self._errors.append(f'{path} : {error}')
+
+        for path, member in self._symlinks:
+            try:
+                os.symlink(member.linkname, path)
+                self._set_attributes(path, member)
+            except OSError as error: self._errors.append(f'{path} : {error}')
+
+        for path, member in reversed(self._directories):
+            self._set_attributes(path, member)
+
+    def _open(self, hashing: HashingFile):
+        compressor = self._compressor()
+
+        if not compressor:
+            return None, None, tarfile.open(fileobj=hashing, mode='r|xz')
+
+        process = subprocess.Popen(
+            COMPRESSORS[compressor]['decompress'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        feeder = threading.Thread(target=_pump, args=(hashing, process.stdin))
+        feeder.start()
+        return process, feeder, tarfile.open(fileobj=process.stdout, mode='r|')
+
+    def _unpack(self) -> Tuple[dict|None, str]:
+        header = None
+
+        with open(self.path, 'rb') as image:
+            hashing = HashingFile(image)
+            process, feeder, tar = self._open(hashing)
+
+            try:
+                with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                    for member in tar:
+                        if header is None:
+                            if member.name != HEADER_NAME: break
+
+                            header = json.loads(tar.extractfile(member).read())
+                            if header.get('format') != IMAGE_FORMAT: break
+
+                            if not self._prepare(header['entries']): break
+                            continue
+
+                        self._extract(tar, member, executor)
+            finally:
+                tar.close()
+
+                if process:
+                    process.stdout.close()
+                    feeder.join()
+                    process.wait()
+                else: hashing.drain()
+
+        if header and header.get('format') != IMAGE_FORMAT:
+            self._errors.append(f"Unsupported image format : {header.get('format')}")
+
+        return header, hashing.hash.hexdigest()
+
+    def _prepare(self, entries: List[str]) -> bool:
+        existing = [entry for entry in entries if os.path.lexists(entry)]
+
+        if existing:
+            self._errors.append(f"Existing paths : {', '.join(existing)}")
+            return False
+
+        for entry in entries:
+            parent, name = os.path.split(entry)
+            os.makedirs(parent, exist_ok=True)
+            self._staging[entry] = f'{parent}/.{name}.image-{os.getpid()}'
+
+        return True
+
+    def _discard(self) -> None:
+        for staging in self._staging.values():
+            if os.path.lexists(staging): fs.remove(staging)
+
+    def _install(self) -> bool:
+        for entry, staging in self._staging.items():
+            try: os.rename(staging, entry)
+            except OSError as error:
+                self._errors.append(f'{entry} : {error}')
+                return False
+
+        return True
+
+    def read(self) -> dict|None:
+        """Unpacks the image, returns its header, None on failure."""
+        expected = self.expected_checksum()
+
+        if not expected:
+            print(cli.TypedMsg(f'Missing checksum : {checksum_path(self.path)}').failure)
+            return None
+
+        try:
+            with trace.tracer.span(f'Image.verify {self.path}', 'image'): checksum = self.checksum()
+        except OSError as error:
+            print(cli.TypedMsg(str(error)).failure, file=sys.stderr)
+            return None
+
+        if checksum != expected:
+            print(cli.TypedMsg(f'Checksum mismatch : {checksum} expected {expected}').failure, file=sys.stderr)
+            return None
+
+        try:
+            with trace.tracer.span(f'Image.unpack {self.path}', 'image'):
+                header, checksum = self._unpack()
+                if not self._errors: self._finish()
+        except (OSError, ValueError, tarfile.TarError) as error:
+            header, checksum = None, None
+            self._errors.append(str(error))
+
+        if checksum and checksum != expected:
+            self._errors.append(f'Image changed while unpacking : {checksum} expected {expected}')
+        if not header and not self._errors:
+            self._errors.append('Not a vixen image')
+
+        if self._errors or not self._install():
+            for error in self._errors: print(cli.TypedMsg(error).failure, file=sys.stderr)
+            self._discard()
+            return None
+
+        return header
+
+def export_image(path: str) -> bool:
+    purpose = f'Export image {path}'
+
+    with state.status_store._locked() as locked:
+        status = locked and state.read()
+
+        if not status:
+            print(cli.CheckMsg(purpose).failure)
+            return False
+
+        try:
+            with trace.tracer.span(purpose, 'image'): result = ImageWriter(path).write(status)
+        except (OSError, tarfile.TarError) as error:
+            print(error)
+            result = False
+
+    print(cli.CheckMsg(purpose).success if result else cli.CheckMsg(purpose).failure)
+    return result
+
+def import_image(path: str) -> bool:
+    purpose = f'Import image {path}'
+
+    with state.status_store._locked() as locked:
+        if not locked or state.exists():
+            if locked: print(f"{purpose} : {cli.TypedMsg('packages state already exists').warning}")
+            print(cli.CheckMsg(purpose).failure)
+            return False
+
+        header = ImageReader(path).read()
+        result = bool(header) and state.create(header['status']) and all(
+            state.database.register(
+                feature['name'],
+                feature.get('version', ''),
+                feature.get('paths', []),
+                feature.get('fingerprints', {})
+            )
+            for feature in header['features']
+        )
+
+    print(cli.CheckMsg(purpose).success if result else cli.CheckMsg(purpose).failure)
+    return result
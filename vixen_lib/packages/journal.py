@@ -0,0 +1,156 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages write-ahead journal.
+License           : GPL3
+"""
+
+import os, json
+from datetime import datetime
+from typing import Dict, List, Set
+
+JOURNAL_PATH = '/var/opt/vixen/journal.jsonl'
+
+class JournalEvent:
+    BEGIN: str = 'begin'
+    RESUME: str = 'resume'
+    SNAPSHOT: str = 'snapshot'
+    TASK_START: str = 'task_start'
+    TASK_DONE: str = 'task_done'
+    COMMIT: str = 'commit'
+
+class Journal:
+    """Write-ahead journal of the running setup (or transaction).
+
+    Every event is appended and synced to disk before the step it
+    announces goes on: the request, the snapshot taken, and the start and
+    completion of every task. The journal is removed once the run is
+    finalized, so a journal left behind by a process which is gone is an
+    interrupted run. It can be resumed, skipping the tasks already done
+    and keeping the snapshot of the first attempt, or rolled back with
+    that snapshot. A torn last line (power loss) is ignored.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH) -> None:
+        self.path = path
+        self.request: Dict[str, List[str]]|None = None
+        self.is_resuming = False
+        self.is_open = False
+        self._events: List[dict]|None = None
+
+    def relocate(self, path: str) -> None:
+        self.path = path
+        self.reload()
+
+    def reload(self) -> None:
+        self._events = None
+
+    @property
+    def events(self) -> List[dict]:
+        if self._events is not None: return self._events
+
+        self._events = []
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try: self._events.append(json.loads(line))
+                    except ValueError: break
+        except FileNotFoundError: pass
+
+        return self._events
+
+    def _append(self, event: str, **data) -> bool:
+        if not self.is_open: return True
+
+        record = {'event': event, 'time': datetime.now().isoformat(timespec='seconds'), **data}
+        directory = os.path.dirname(self.path)
+        is_new = not os.path.exists(self.path)
+
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (json.dumps(record) + '\n').encode())
+                os.fsync(fd)
+            finally: os.close(fd)
+
+            if is_new:
+                directory_fd = os.open(directory, os.O_RDONLY)
+                try: os.fsync(directory_fd)
+                finally: os.close(directory_fd)
+        except OSError as error:
+            print(error)
+            return False
+
+        self.events.append(record)
+        return True
+
+    def _last(self, event: str) -> dict|None:
+        return next((record for record in reversed(self.events) if record['event'] == event), None)
+
+    @property
+    def exists(self) -> bool:
+        return bool(self.events)
+
+    @property
+    def recorded_request(self) -> Dict[str, List[str]]|None:
+        begin = self._last(JournalEvent.BEGIN)
+        return begin.get('request') if begin else None
+
+    @property
+    def recorded_state(self) -> dict|None:
+        """The state data of the run, to roll it back."""
+        begin = self._last(JournalEvent.BEGIN)
+        return begin.get('state') if begin else None
+
+    @property
+    def is_committed(self) -> bool:
+        """The state and the features were written, only the cleanup was
+        interrupted."""
+        return self._last(JournalEvent.COMMIT) is not None
+
+    @property
+    def snapshot(self) -> dict|None:
+        return self._last(JournalEvent.SNAPSHOT)
+
+    def snapshot_ids(self) -> Set[str]:
+        return {record['id'] for record in self.events if record['event'] == JournalEvent.SNAPSHOT}
+
+    def done_tasks(self, setup_index: int) -> Set[str]:
+        """Tasks of a setup completed before the interruption."""
+        if not self.is_resuming: return set()
+
+        return {
+            record['task'] for record in self.events
+            if record['event'] == JournalEvent.TASK_DONE and record['setup'] == setup_index
+        }
+
+    def begin(self, state: dict|None = None) -> bool:
+        self.is_open = True
+        if self.is_resuming: return self._append(JournalEvent.RESUME, pid=os.getpid())
+
+        self._events = []
+        return self._append(JournalEvent.BEGIN, pid=os.getpid(), request=self.request, state=state)
+
+    def record_snapshot(self, snapshot_id: str, mode: str, entries: List[str]) -> bool:
+        return self._append(JournalEvent.SNAPSHOT, id=snapshot_id, mode=mode, entries=entries)
+
+    def task_started(self, setup_index: int, name: str) -> bool:
+        return self._append(JournalEvent.TASK_START, setup=setup_index, task=name)
+
+    def task_done(self, setup_index: int, name: str) -> bool:
+        return self._append(JournalEvent.TASK_DONE, setup=setup_index, task=name)
+
+    def commit(self) -> bool:
+        return self._append(JournalEvent.COMMIT)
+
+    def clear(self) -> None:
+        try: os.remove(self.path)
+        except FileNotFoundError: pass
+
+        self._events = []
+        self.request = None
+        self.is_resuming = False
+        self.is_open = False
+
+journal = Journal()
@@ -0,0 +1,88 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen setup modules loader.
+License           : GPL3
+"""
+
+import os, types, marshal, hashlib, importlib.util
+from typing import Dict
+
+SETUP_FILE_NAME = 'vxm.setup.py'
+SETUP_CACHE_DIRECTORY = '/var/opt/vixen/setup_cache'
+
+class SetupLoader:
+    """Loads `vxm.setup.py` modules from bytecode cached by source hash.
+
+    The cache key also covers the interpreter bytecode version, and only
+    the last compiled version of each setup file is kept. The cache works
+    for read-only feature directories, where `__pycache__` can't be
+    written. Evaluated modules hold callbacks (lambdas) and can't be
+    stored, so they are only reused within the process.
+    """
+
+    def __init__(self, directory: str = SETUP_CACHE_DIRECTORY) -> None:
+        self.directory = directory
+        self._modules: Dict[tuple, types.ModuleType] = {}
+        self._codes: Dict[str, types.CodeType] = {}
+
+    def _cache_paths(self, path: str, source: bytes) -> tuple:
+        prefix = hashlib.sha256(path.encode()).hexdigest()[:16]
+        key = hashlib.sha256(importlib.util.MAGIC_NUMBER + source).hexdigest()
+        return prefix, f'{self.directory}/{prefix}.{key}.pyc'
+
+    def _read_code(self, cache_path: str) -> types.CodeType|None:
+        try:
+            with open(cache_path, 'rb') as file: return marshal.load(file)
+        except (OSError, EOFError, ValueError, TypeError): return None
+
+    def _write_code(self, prefix: str, cache_path: str, code: types.CodeType) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary_path = f'{self.directory}/.{os.getpid()}.tmp'
+            with open(temporary_path, 'wb') as file: marshal.dump(code, file)
+            os.replace(temporary_path, cache_path)
+
+            for name in os.listdir(self.directory):
+                if name.startswith(f'{prefix}.') and f'{self.directory}/{name}' != cache_path:
+                    os.remove(f'{self.directory}/{name}')
+        except OSError: pass
+
+    def code(self, path: str, source: bytes) -> types.CodeType:
+        prefix, cache_path = self._cache_paths(path, source)
+        code = self._codes.get(cache_path) or self._read_code(cache_path)
+
+        if code is None:
+            code = compile(source, path, 'exec', dont_inherit=True)
+            self._write_code(prefix, cache_path, code)
+
+        self._codes[cache_path] = code
+        return code
+
+    def prepare(self, directory: str) -> bool:
+        """Keeps the bytecode of a setup file in memory without running it
+        (processes forked afterwards start with it)."""
+        path = os.path.abspath(f'{directory}/{SETUP_FILE_NAME}')
+
+        try:
+            with open(path, 'rb') as file: self.code(path, file.read())
+        except (OSError, SyntaxError): return False
+
+        return True
+
+    def load(self, directory: str) -> types.ModuleType:
+        path = os.path.abspath(f'{directory}/{SETUP_FILE_NAME}')
+        with open(path, 'rb') as file: source = file.read()
+
+        key = (path, hashlib.sha256(source).digest())
+        if key in self._modules: return self._modules[key]
+
+        module = types.ModuleType('setup')
+        module.__file__ = path
+        exec(self.code(path, source), module.__dict__)
+
+        self._modules[key] = module
+        return module
+
+setup_loader = SetupLoader()
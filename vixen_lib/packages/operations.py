@@ -0,0 +1,105 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages operations, shared by vxm and its daemon.
+License           : GPL3
+"""
+
+import os, json
+from typing import Dict, List, Optional
+from .loader import setup_loader
+from ..tools import cli
+
+OPERATIONS = {
+    'install': 'setup',
+    'update': 'update',
+    'remove': 'remove'
+}
+
+def absolute_operations(operations: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    return {
+        operation: [os.path.abspath(path) for path in operations.get(operation, [])]
+        for operation in OPERATIONS
+    }
+
+def setups_data(operations: Dict[str, List[str]]) -> List[dict]:
+    """The setup dicts of the operations, each marked with its operation."""
+    return [
+        {**getattr(setup_loader.load(path), OPERATIONS[operation]), 'operation': operation}
+        for operation in OPERATIONS
+        for path in operations.get(operation, [])
+    ]
+
+def process(operations: Dict[str, List[str]]) -> None:
+    """Runs the operations, a single setup on its own and several as one
+    transaction. Exits with the result, like the setups."""
+    from . import Setup, Transaction
+    from .journal import journal
+
+    journal.request = operations
+    data = setups_data(operations)
+
+    if len(data) == 1: Setup(data[0]).process()
+    if len(data) > 1: Transaction(data).process()
+
+def resume() -> bool:
+    """Processes again the operations of an interrupted run, skipping
+    the tasks it completed."""
+    from . import state
+    from .journal import journal
+
+    journal.reload()
+    if not journal.exists or journal.is_committed:
+        return state.close_interrupted(False)
+
+    request = journal.recorded_request
+    if request is None:
+        print(cli.TypedMsg('The interrupted run was not started from setup files, it can only be rolled back (vxm --rollback)').failure)
+        return False
+
+    journal.is_resuming = True
+    process(request)
+    return True
+
+def rollback() -> bool:
+    from . import state
+    return state.close_interrupted(True)
+
+def export_image(path: str) -> bool:
+    from .image import export_image
+    return export_image(path)
+
+def import_image(path: str) -> bool:
+    from .image import import_image
+    return import_image(path)
+
+def collect_snapshots(
+    keep_last: Optional[int|None] = None,
+    max_bytes: Optional[int|None] = None
+) -> bool:
+    from . import state
+
+    report = state.collect_snapshots(keep_last, max_bytes)
+    purpose = 'Collect snapshots'
+
+    if report is None:
+        print(cli.CheckMsg(purpose).failure)
+        return False
+
+    removed = f"{report['removed']} removed, {report['freed']} bytes freed"
+    print(f"{purpose} : {cli.TypedMsg(removed).warning}")
+    print(f"Snapshots : {report['snapshots']} kept, {report['bytes']} bytes, store {report['store_bytes']} bytes")
+
+    msg = cli.CheckMsg(purpose)
+    print(msg.failure if report['failed'] else msg.success)
+    return not report['failed']
+
+def status() -> bool:
+    from . import state
+
+    print(json.dumps({
+        'state': state.read() if state.exists() else None,
+        'features': state.database.features()
+    }, indent=4))
+    return True
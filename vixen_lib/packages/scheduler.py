@@ -0,0 +1,129 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages tasks scheduler.
+License           : GPL3
+"""
+
+from typing import Dict, List, Protocol, Set
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from ..tools import cli
+
+DEFAULT_MAX_WORKERS = 4
+
+class Schedulable(Protocol):
+    name: str
+    depends_on: List[str]
+    provides: List[str]
+
+    def run(self) -> bool: ...
+
+class Scheduler:
+    """Runs tasks as a dependency graph on a bounded worker pool.
+
+    A task waits for every task providing one of its `depends_on` keys.
+    A task which does not declare `depends_on` waits for the previous
+    task, so a setup without any key keeps its sequential order.
+    """
+
+    def __init__(
+        self,
+        tasks: List[Schedulable],
+        max_workers: int = DEFAULT_MAX_WORKERS
+    ) -> None:
+        self._tasks = tasks
+        self._max_workers = max(1, max_workers)
+        self._dependencies: Dict[int, Set[int]] = {}
+        self._error: str|None = None
+
+        self._build_graph()
+
+    @property
+    def error(self) -> str|None:
+        return self._error
+
+    def _build_graph(self) -> None:
+        providers: Dict[str, List[int]] = {}
+
+        for index, task in enumerate(self._tasks):
+            for key in task.provides:
+                providers.setdefault(key, []).append(index)
+
+        for index, task in enumerate(self._tasks):
+            dependencies = set()
+
+            if task.depends_on is None:
+                if index > 0: dependencies.add(index - 1)
+            else:
+                for key in task.depends_on:
+                    if key not in providers:
+                        self._error = f"Unknown dependency '{key}'"
+                        return
+                    dependencies.update(providers[key])
+
+            dependencies.discard(index)
+            self._dependencies[index] = dependencies
+
+        if self._has_cycle(): self._error = 'Tasks dependencies cycle'
+
+    def _has_cycle(self) -> bool:
+        pending = {index: set(deps) for index, deps in self._dependencies.items()}
+
+        while pending:
+            ready = [index for index, deps in pending.items() if not deps]
+            if not ready: return True
+
+            for index in ready: del pending[index]
+            for deps in pending.values(): deps.difference_update(ready)
+
+        return False
+
+    def _show_error(self) -> None:
+        prompt = cli.TypedMsg('Tasks scheduling failed').failure
+        print(f"{prompt} : {self._error}")
+
+    def _succeeded(self, index: int, future: Future) -> bool:
+        """A task raising is a failed task: the run goes on to the state
+        finalization, which restores the snapshot and unlocks the state."""
+        try: return future.result()
+        except Exception as error:
+            prompt = cli.TypedMsg(self._tasks[index].name).failure
+            print(f"{prompt} : {type(error).__name__}: {error}")
+            return False
+
+    def run(self) -> bool:
+        if self._error:
+            self._show_error()
+            return False
+
+        remaining = {index: set(deps) for index, deps in self._dependencies.items()}
+        running: Dict[Future, int] = {}
+        success = True
+
+        with cli.forwarded_interrupts(), ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            while True:
+                if success:
+                    ready = [index for index, deps in remaining.items() if not deps]
+
+                    for index in ready:
+                        del remaining[index]
+                        running[executor.submit(self._tasks[index].run)] = index
+
+                if not running: break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = running.pop(future)
+                    if future.cancelled(): continue
+
+                    if not self._succeeded(index, future):
+                        if success:
+                            for pending in running: pending.cancel()
+                        success = False
+                        continue
+
+                    for deps in remaining.values(): deps.discard(index)
+
+        return success and not remaining
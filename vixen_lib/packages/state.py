@@ -1,16 +1,26 @@
-from typing import List, Optional
-from ..tools import fs, json, cli
-from ..snapshots import SnapShot
+import os, sys, copy, fcntl
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from ..tools import fs, json, cli, trace
+from ..snapshots import SnapShot, SnapMode, Catalog
+from .database import StateDatabase
+from .journal import journal, JOURNAL_PATH
 
 STATUS_PATH = {
     'parent_directory': '/var/opt/vixen',
-    'file_name': 'package_status.json'
+    'file_name': 'package_status.json',
+    'lock_name': 'package_status.lock',
+    'trace_name': 'last_run.trace.json',
+    'journal_name': os.path.basename(JOURNAL_PATH)
 }
 STATUS_PATH['path'] = f"{STATUS_PATH['parent_directory']}/{STATUS_PATH['file_name']}"
+STATUS_PATH['lock_path'] = f"{STATUS_PATH['parent_directory']}/{STATUS_PATH['lock_name']}"
+STATUS_PATH['trace_path'] = f"{STATUS_PATH['parent_directory']}/{STATUS_PATH['trace_name']}"
+DATABASE_PATH = f"{STATUS_PATH['parent_directory']}/packages.db"
 SNAPSHOTS_PARENT_DIRECTORY = '/var/opt/vixen/snapshots'
-
-def exists() -> bool:
-    return fs.exists(STATUS_PATH['path'])
+SNAPSHOTS_MODE_ENV_VAR = 'VIXEN_SNAPSHOTS_MODE'
+SNAPSHOTS_MODE = SnapMode(os.environ.get(SNAPSHOTS_MODE_ENV_VAR, SnapMode.STORE.value))
+SNAPSHOTS_RETENTION = {'keep_last': 2, 'max_bytes': 1 << 30}
 
 def create_directory() -> bool:
     return fs.create(
@@ -18,32 +28,225 @@ def create_directory() -> bool:
         file_type=fs.FileType.DIRECTORY
     )
 
+class StatusStore:
+    """Packages status file cached in memory.
+
+    The cached data stays valid as long as the file keeps the same
+    (mtime, size, inode). Writes are atomic and done under an exclusive
+    advisory lock, which `State` also holds for a whole setup run.
+    """
+
+    def __init__(self, path: str, lock_path: str) -> None:
+        self._path = path
+        self._lock_path = lock_path
+        self._lock_fd: int|None = None
+        self._data: dict|None = None
+        self._signature: tuple|None = None
+
+    def _file_signature(self) -> tuple|None:
+        try: file_stat = os.stat(self._path)
+        except FileNotFoundError: return None
+        return (file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino)
+
+    @property
+    def is_locked(self) -> bool:
+        return self._lock_fd is not None
+
+    def lock(self) -> bool:
+        if self.is_locked: return True
+        if not create_directory(): return False
+
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try: fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(cli.TypedMsg('Waiting for another vxm process').warning)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+        return True
+
+    def unlock(self) -> None:
+        if not self.is_locked: return
+
+        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+    @contextmanager
+    def _locked(self):
+        owner = not self.is_locked
+        if owner and not self.lock():
+            yield False
+            return
+
+        try: yield True
+        finally:
+            if owner: self.unlock()
+
+    def exists(self) -> bool:
+        return self._file_signature() is not None
+
+    def read(self) -> dict|None:
+        signature = self._file_signature()
+        if not signature: return None
+
+        if signature != self._signature:
+            data = json.read(self._path)
+            if data is None: return None
+            self._data, self._signature = data, signature
+
+        return copy.deepcopy(self._data)
+
+    def write(self, data: dict) -> bool:
+        with self._locked() as locked:
+            if not locked or not json.write(self._path, data): return False
+
+            self._data = copy.deepcopy(data)
+            self._signature = self._file_signature()
+            return True
+
+    def update(self, data: dict) -> bool:
+        with self._locked() as locked:
+            if not locked: return False
+
+            current = self.read()
+            if current is None: return False
+
+            current.update(data)
+            return self.write(current)
+
+status_store = StatusStore(STATUS_PATH['path'], STATUS_PATH['lock_path'])
+database = StateDatabase(DATABASE_PATH)
+
+def set_parent_directory(path: str) -> None:
+    """Relocates the status, lock, trace, database and snapshots under
+    `path` (benchmarks, sandboxed runs)."""
+    global SNAPSHOTS_PARENT_DIRECTORY, status_store, database
+
+    STATUS_PATH['parent_directory'] = path
+    STATUS_PATH['path'] = f"{path}/{STATUS_PATH['file_name']}"
+    STATUS_PATH['lock_path'] = f"{path}/{STATUS_PATH['lock_name']}"
+    STATUS_PATH['trace_path'] = f"{path}/{STATUS_PATH['trace_name']}"
+    journal.relocate(f"{path}/{STATUS_PATH['journal_name']}")
+
+    SNAPSHOTS_PARENT_DIRECTORY = f'{path}/snapshots'
+    status_store = StatusStore(STATUS_PATH['path'], STATUS_PATH['lock_path'])
+    database.close()
+    database = StateDatabase(f'{path}/packages.db')
+
+def exists() -> bool:
+    return status_store.exists()
+
 def create(data: dict) -> bool:
     if not create_directory(): return False
-    return json.create(
-        path=STATUS_PATH['path'],
-        data=data
-    )
+    return status_store.write(data)
 
 def update(data: dict) -> bool:
     if not exists(): return False
-    return json.update(
-        path=STATUS_PATH['path'],
-        data=data
-    )
+    return status_store.update(data)
 
 def read() -> dict|None:
-    if not exists(): return None
-    return json.read(STATUS_PATH['path'])
+    return status_store.read()
 
 def combine_list(a_list: List[str], b_list: List[str]) -> List[str]:
-    ele_b = [item for item in b_list if item not in a_list]
-    ele_a = [item for item in a_list if item not in b_list]
-    return ele_b + ele_a
+    return list(dict.fromkeys(b_list + a_list))
+
+def data_paths(data: Optional[dict|None]) -> List[str]:
+    if not data: return []
+
+    paths = list(data.get('exec_paths', []))
+    if data.get('env_path'): paths.append(data['env_path'])
+    return paths
+
+def collect_snapshots(
+    keep_last: Optional[int|None] = None,
+    max_bytes: Optional[int|None] = None
+) -> dict|None:
+    """Applies the retention policy to the orphaned snapshots, under the
+    packages state lock so no running setup loses its snapshot."""
+    if keep_last is None: keep_last = SNAPSHOTS_RETENTION['keep_last']
+    if max_bytes is None: max_bytes = SNAPSHOTS_RETENTION['max_bytes']
+
+    with status_store._locked() as locked:
+        if not locked: return None
+
+        journal.reload()
+        return Catalog(SNAPSHOTS_PARENT_DIRECTORY).collect(keep_last, max_bytes, journal.snapshot_ids())
+
+def collect_snapshots_in_background() -> None:
+    """Forks a detached process collecting the orphaned snapshots, when
+    the retention policy has anything to remove."""
+    catalog = Catalog(SNAPSHOTS_PARENT_DIRECTORY)
+    journal.reload()
+    pinned = journal.snapshot_ids()
+    if (
+        not catalog.plan(**SNAPSHOTS_RETENTION, pinned=pinned)
+        and not catalog.drops_index(**SNAPSHOTS_RETENTION, pinned=pinned)
+    ): return
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if os.fork() != 0: return
+
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2): os.dup2(devnull, fd)
+        # Inherited descriptors, such as the client connection of a
+        # daemon job, would stay open until the collection is done.
+        os.closerange(3, os.sysconf('SC_OPEN_MAX'))
+        collect_snapshots()
+    finally: os._exit(0)
 
 def snapshot_builder(status: dict) -> SnapShot:
     entries = [status['env_path']] + status['exec_paths']
-    return SnapShot(SNAPSHOTS_PARENT_DIRECTORY, entries)
+    return SnapShot(SNAPSHOTS_PARENT_DIRECTORY, entries, SNAPSHOTS_MODE)
+
+def journaled_snapshot() -> SnapShot|None:
+    """The snapshot taken by the interrupted run. Lazy snapshots keep
+    their pre-images in their process, they don't outlive it."""
+    record = journal.snapshot
+    if not record or record['mode'] == SnapMode.LAZY.value: return None
+
+    return SnapShot(
+        SNAPSHOTS_PARENT_DIRECTORY,
+        record['entries'],
+        SnapMode(record['mode']),
+        snapshot_id=record['id']
+    )
+
+def close_interrupted(restore: bool) -> bool:
+    """Closes the journal of an interrupted run, restoring its snapshot
+    first when `restore` is set and the run was not committed."""
+    purpose = 'Rollback interrupted run' if restore else 'Close interrupted run'
+
+    with status_store._locked() as locked:
+        if not locked: return False
+
+        journal.reload()
+        if not journal.exists:
+            print(f"{purpose} : {cli.TypedMsg('no interrupted run').warning}")
+            return True
+
+        result = True
+        snapshot = journaled_snapshot()
+
+        if restore and journal.is_committed:
+            print(f"{purpose} : {cli.TypedMsg('the run was committed').warning}")
+            restore = False
+
+        if journal.snapshot and not snapshot:
+            print(f"{purpose} : {cli.TypedMsg('the lazy snapshot did not outlive its process').warning}")
+            result = not restore
+        else:
+            if restore: result = State((journal.recorded_state or {}).get('new_data')).rollback(snapshot)
+            if result and snapshot: result = snapshot.remove()
+
+        if result: journal.clear()
+
+        msg = cli.CheckMsg(purpose)
+        print(msg.success if result else msg.failure)
+        return result
 
 class State:
     class Purpose:
@@ -55,16 +258,49 @@ class State:
         CREATE_SNAPSHOT: str = 'Create snapshot'
         RESTORE_SNAPSHOT: str = 'Restore snapshot'
         REMOVE_SNAPSHOT: str = 'Remove snapshot'
-
-    def __init__(self, data: Optional[dict|None] = None) -> None:
+        CHECK_OWNERSHIP: str = 'Check paths ownership'
+        REGISTER_FEATURE: str = 'Register feature'
+        UNREGISTER_FEATURE: str = 'Unregister feature'
+        RESUME: str = 'Resume interrupted run'
+
+    def __init__(
+        self,
+        data: Optional[dict|None] = None,
+        feature: Optional[dict|None] = None,
+        is_removal: bool = False
+    ) -> None:
         self._initial_state = False
-
-        if data:
-            if data.get('env_path'): self._initial_state = True
-
-        self._new_data = data
+        self._features: List[tuple] = []
+        self._removed_features: List[dict] = []
+        self._fingerprints: Dict[str, Dict[str, str]] = {}
+        self._new_data = None
         self._current_state = None
         self._snapshot = None
+        self._is_journaled = False
+
+        self.add(data, feature, is_removal)
+
+    def add(
+        self,
+        data: Optional[dict|None] = None,
+        feature: Optional[dict|None] = None,
+        is_removal: bool = False
+    ) -> None:
+        if feature and is_removal: self._removed_features.append(feature)
+        elif feature: self._features.append((feature, data_paths(data)))
+        if not data: return
+
+        if data.get('env_path'): self._initial_state = True
+
+        if not self._new_data:
+            self._new_data = dict(data)
+            return
+
+        for key, value in data.items():
+            if key == 'exec_paths':
+                self._new_data[key] = combine_list(value, self._new_data.get(key, []))
+            else:
+                self._new_data.setdefault(key, value)
 
     def _show_check_msg(self, purpose: str, success: bool) -> None:
         msg = cli.CheckMsg(purpose)
@@ -80,6 +316,14 @@ class State:
     def init(self) -> bool:
         purpose = self.Purpose.INIT
 
+        if not status_store.lock():
+            self._show_check_msg(purpose, False)
+            return False
+
+        if not self._begin_journal():
+            self._show_check_msg(purpose, False)
+            return False
+
         if not self._check_state_availability():
             self._show_check_msg(purpose, False)
             return False
@@ -89,8 +333,41 @@ class State:
                 self._show_check_msg(purpose, False)
                 return False
 
+        if not self._check_ownership():
+            self._show_check_msg(purpose, False)
+            return False
+
         self._show_check_msg(purpose, True)
         return True
+
+    def _begin_journal(self) -> bool:
+        journal.reload()
+
+        if journal.is_resuming and not journal.exists:
+            self._show_msg(self.Purpose.RESUME, 'no interrupted run')
+            return False
+
+        if not journal.is_resuming and journal.exists:
+            self._show_msg(self.Purpose.RESUME, 'an interrupted run is pending (vxm --resume or vxm --rollback)')
+            return False
+
+        self._is_journaled = journal.begin({'new_data': self._new_data})
+        return self._is_journaled
+
+    def _check_ownership(self) -> bool:
+        if not self._features: return True
+
+        purpose = self.Purpose.CHECK_OWNERSHIP
+        conflicts = {}
+
+        for feature, paths in self._features:
+            conflicts.update(database.conflicts(feature['name'], paths))
+
+        for path, owner in conflicts.items():
+            self._show_msg(purpose, f"{path} is owned by {owner}")
+
+        self._show_check_msg(purpose, not conflicts)
+        return not conflicts
     
     def _check_state_availability(self) -> bool:
         purpose = self.Purpose.CHECK_STATE_SUB
@@ -115,25 +392,62 @@ class State:
         self._current_state = data
         return True
         
-    def create_snapshot(self) -> bool:
+    def recorded_fingerprints(self, name: str) -> Dict[str, str]:
+        if self._initial_state: return {}
+        return database.fingerprints(name)
+
+    def add_fingerprints(self, name: str, fingerprints: Dict[str, str]) -> None:
+        self._fingerprints.setdefault(name, {}).update(fingerprints)
+
+    def create_snapshot(self, up_to_date: bool = False) -> bool:
         purpose = self.Purpose.CREATE_SNAPSHOT
 
         if self._initial_state:
             self._show_msg(purpose, 'skipped')
             return True
 
-        self._snapshot = snapshot_builder(self._current_state)
-        return self._snapshot.create()
+        if journal.is_resuming and journal.snapshot:
+            self._snapshot = journaled_snapshot()
+            if self._snapshot:
+                self._show_msg(purpose, 'resumed')
+                return True
+
+            self._show_msg(purpose, 'the lazy snapshot did not outlive its process')
+
+        if up_to_date:
+            self._show_msg(purpose, 'up to date')
+            return True
+
+        with trace.tracer.span(purpose, 'state'):
+            self._snapshot = snapshot_builder(self._current_state)
+            if not self._snapshot.create(): return False
+
+        return journal.record_snapshot(
+            self._snapshot.id,
+            SNAPSHOTS_MODE.value,
+            [self._current_state['env_path']] + self._current_state['exec_paths']
+        )
+
+    def rollback(self, snapshot: SnapShot|None) -> bool:
+        """Rolls an interrupted run of this state data back, with the
+        snapshot it took."""
+        self._snapshot = snapshot
+        if not self._initial_state: self._current_state = read()
+        return self.restore_snapshot()
 
     def restore_snapshot(self) -> bool:
         purpose = self.Purpose.RESTORE_SNAPSHOT
 
+        if self._initial_state:
+            with trace.tracer.span(purpose, 'state'): return self._clean_initial_state()
+
         if not self._snapshot:
             self._show_msg(purpose, 'no snapshot')
             return True
         
-        self._clean_new_exec()
-        return self._snapshot.restore()
+        with trace.tracer.span(purpose, 'state'):
+            self._clean_new_exec()
+            return self._snapshot.restore()
 
     def remove_snapshot(self) -> bool:
         purpose = self.Purpose.REMOVE_SNAPSHOT
@@ -144,12 +458,27 @@ class State:
 
         return self._snapshot.remove()
 
+    def _clean_initial_state(self) -> bool:
+        """Without a previous state there is no snapshot: the paths of the
+        new state are removed instead."""
+        result = True
+
+        for path in [self._new_data['env_path']] + self._new_data.get('exec_paths', []):
+            if fs.exists(path) or os.path.islink(path):
+                removed = fs.remove(path)
+                self._show_check_msg(f"Remove {path}", removed)
+                result = result and removed
+
+        return result
+
     def _clean_new_exec(self) -> None:
-        if not self._new_data or self._initial_state:
+        if not self._new_data or self._initial_state or not self._current_state:
             return
 
+        current_exec_paths = set(self._current_state['exec_paths'])
+
         for path in self._new_data['exec_paths']:
-            if path not in self._current_state['exec_paths'] and fs.exists(path):
+            if path not in current_exec_paths and fs.exists(path):
                 result = fs.remove(path)
                 self._show_check_msg(f"Remove {path}", result)
     
@@ -177,7 +506,55 @@ class State:
         self._show_check_msg(purpose, True)
         return True
 
-    def finalize(self, success: bool, restore: bool) -> None:
-        if not success and restore: self.restore_snapshot()
-        if success: self.update_state()
-        self.remove_snapshot()
\ No newline at end of file
+    def register_feature(self) -> bool:
+        purpose = self.Purpose.REGISTER_FEATURE
+
+        if not self._features:
+            self._show_msg(purpose, 'no feature data')
+            return True
+
+        result = all(
+            database.register(
+                feature['name'],
+                feature.get('version', ''),
+                paths,
+                self._fingerprints.get(feature['name'], {})
+            )
+            for feature, paths in self._features
+        )
+        self._show_check_msg(purpose, result)
+        return result
+
+    def unregister_features(self) -> bool:
+        """Drops the removed features, with their paths and fingerprints."""
+        if not self._removed_features: return True
+
+        result = all(database.unregister(feature['name']) for feature in self._removed_features)
+        self._show_check_msg(self.Purpose.UNREGISTER_FEATURE, result)
+        return result
+
+    def finalize(self, success: bool, restore: bool) -> bool:
+        """Commits a successful run, or restores the snapshot of a failed
+        one. Unless either went through, the snapshot and the journal are
+        kept for `vxm --resume` or `vxm --rollback`. Returns whether the
+        run was committed."""
+        committed = bool(
+            success and self.update_state()
+            and self.register_feature() and self.unregister_features()
+            and journal.commit()
+        )
+        settled = committed or (not success and (not restore or self.restore_snapshot()))
+
+        if settled:
+            self.remove_snapshot()
+            if self._is_journaled: journal.clear()
+        else: self._show_msg(self.Purpose.REMOVE_SNAPSHOT, 'kept (vxm --resume or vxm --rollback)')
+
+        self._write_trace()
+        status_store.unlock()
+        collect_snapshots_in_background()
+        return committed
+
+    def _write_trace(self) -> None:
+        if status_store.is_locked: trace.tracer.write(STATUS_PATH['trace_path'])
+        if trace.tracer.profile: print(f"\n{trace.tracer.summary()}\n")
\ No newline at end of file
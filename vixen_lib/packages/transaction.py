@@ -0,0 +1,59 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages transactions.
+License           : GPL3
+"""
+
+from typing import List
+from .core import Setup
+from .state import State
+from ..tools import cli
+
+class Transaction:
+    """Processes several setups as a single unit of work.
+
+    The packages state is loaded and locked once, one snapshot covers the
+    shared environment for every setup, and the status is written once at
+    the end. The first failing setup rolls the whole transaction back.
+    """
+
+    def __init__(self, setups_data: List[dict]) -> None:
+        self._setups: List[Setup] = []
+        self._purpose: str = f'Transaction ({len(setups_data)} setups)'
+
+        print(f'\n{cli.TypedMsg(self._purpose).title}\n')
+
+        self._init_state(setups_data)
+        self._setups = [
+            Setup(data, self._state, index) for index, data in enumerate(setups_data)
+        ]
+        self._init_snapshot()
+
+    def _init_state(self, setups_data: List[dict]) -> None:
+        self._state = State()
+
+        for data in setups_data:
+            self._state.add(data.get('state'), data.get('feature'), data.get('operation') == 'remove')
+
+        if not self._state.init(): self._finalize(False)
+
+    def _init_snapshot(self) -> None:
+        up_to_date = all(setup.is_up_to_date for setup in self._setups)
+        if not self._state.create_snapshot(up_to_date): self._finalize(False)
+
+    @property
+    def _has_done_tasks(self) -> bool:
+        return any(setup.has_done_tasks for setup in self._setups)
+
+    def process(self) -> None:
+        with cli.sessions(): result = all(setup.run() for setup in self._setups)
+        self._finalize(result)
+
+    def _finalize(self, success: bool) -> None:
+        success = self._state.finalize(success, self._has_done_tasks)
+
+        msg = cli.CheckMsg('Execution')
+        print(msg.success if success else msg.failure)
+        exit(0 if success else 1)
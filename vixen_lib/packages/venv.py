@@ -0,0 +1,160 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen virtual environments cloned from templates.
+License           : GPL3
+"""
+
+import os, sys, time, fcntl, shlex, shutil, hashlib
+from contextlib import contextmanager
+from typing import Optional
+from ..tools import fs, cli, json, trace
+
+TEMPLATES_DIRECTORY = '/var/opt/vixen/venv_templates'
+TEMPLATE_FILE_NAME = '.vixen-template.json'
+TEMPLATE_MAX_AGE = 30 * 24 * 3600
+PREFIX_FILES = ('pyvenv.cfg', 'bin')
+
+def base_interpreter(python: Optional[str|None] = None) -> str:
+    """The interpreter venvs are created from, outside of any venv."""
+    if python: return os.path.realpath(shutil.which(python) or python)
+    return os.path.realpath(getattr(sys, '_base_executable', sys.executable))
+
+class VenvTemplate:
+    """A pristine venv, pip already upgraded, per interpreter.
+
+    New environments are cloned from it (reflinks, else copies: never
+    hard links, which would let a write in an environment reach the
+    template) instead of being bootstrapped. Without reflinks (ext4),
+    every clone is a full copy of the template: still far cheaper than
+    `python -m venv` (benchmarks/venv_template.py). Its prefix is replaced
+    by theirs in `pyvenv.cfg` and the `bin` scripts (activation scripts,
+    entry point shebangs). The template holds no bytecode, which would
+    embed its own path. It is keyed by the interpreter path and binary,
+    and rebuilt after TEMPLATE_MAX_AGE so pip doesn't grow too old: the
+    new template replaces the old one under an exclusive lock, while
+    clones hold it shared.
+    """
+
+    def __init__(
+        self,
+        python: Optional[str|None] = None,
+        directory: str = TEMPLATES_DIRECTORY
+    ) -> None:
+        self.python = base_interpreter(python)
+        python_stat = os.stat(self.python)
+        key = hashlib.sha256(
+            f'{self.python}:{python_stat.st_size}:{python_stat.st_mtime_ns}'.encode()
+        ).hexdigest()[:16]
+
+        self.directory = directory
+        self.path = f'{directory}/{os.path.basename(self.python)}-{key}'
+
+    @property
+    def _info_path(self) -> str:
+        return f'{self.path}/{TEMPLATE_FILE_NAME}'
+
+    @contextmanager
+    def _locked(self, operation: int):
+        fd = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally: os.close(fd)
+
+    @property
+    def is_ready(self) -> bool:
+        if not fs.exists(self._info_path): return False
+        return time.time() - os.stat(self._info_path).st_mtime < TEMPLATE_MAX_AGE
+
+    def _run(self, command: str) -> bool:
+        result = cli.execute(command)
+        if not result.success: print('\n'.join(result.stderr_tail), file=sys.stderr)
+        return result.success
+
+    def build(self) -> bool:
+        """Creates the template next to its final path, then moves it in
+        place: concurrent builds only lose their own copy."""
+        temporary_path = f'{self.path}.{os.getpid()}.tmp'
+        python = shlex.quote(self.python)
+        prefix = shlex.quote(temporary_path)
+
+        os.makedirs(self.directory, exist_ok=True)
+        if fs.exists(temporary_path): fs.remove(temporary_path)
+
+        with trace.tracer.span(f'VenvTemplate.build {self.path}', 'venv'):
+            result = (
+                self._run(f'{python} -m venv {prefix}')
+                and self._run(f'{prefix}/bin/python -m pip install --quiet --no-compile --upgrade pip')
+                and self._remove_bytecode(temporary_path)
+                and json.write(f'{temporary_path}/{TEMPLATE_FILE_NAME}', {
+                    'prefix': temporary_path,
+                    'python': self.python
+                })
+            )
+
+        if result:
+            with self._locked(fcntl.LOCK_EX):
+                if fs.exists(self.path): fs.remove(self.path)
+
+                try: os.rename(temporary_path, self.path)
+                except OSError: result = self.is_ready
+
+        if fs.exists(temporary_path): fs.remove(temporary_path)
+        return result
+
+    def _remove_bytecode(self, path: str) -> bool:
+        """Bytecode embeds the path of its sources: the clones compile
+        their own."""
+        for directory, directories, _ in os.walk(path):
+            if '__pycache__' in directories:
+                directories.remove('__pycache__')
+                if not fs.remove(f'{directory}/__pycache__'): return False
+
+        return True
+
+    def _fix_prefix(self, path: str, prefix: bytes, new_prefix: bytes) -> None:
+        entries = [path] if os.path.isfile(path) else [
+            entry.path for entry in os.scandir(path) if entry.is_file(follow_symlinks=False)
+        ]
+
+        for entry in entries:
+            with open(entry, 'rb') as file: content = file.read()
+            if prefix not in content: continue
+
+            temporary_path = f'{entry}.{os.getpid()}.tmp'
+            with open(temporary_path, 'wb') as file: file.write(content.replace(prefix, new_prefix))
+            os.chmod(temporary_path, os.stat(entry).st_mode & 0o7777)
+            os.replace(temporary_path, entry)
+
+    def clone(self, path: str) -> bool:
+        """Creates the venv `path` from the template, building it first
+        if needed. Without a template (no network for pip), the venv is
+        created from scratch."""
+        path = os.path.abspath(path)
+
+        if os.path.lexists(path):
+            print(cli.TypedMsg(f'{path} already exists').failure)
+            return False
+
+        if not self.is_ready and not self.build():
+            print(cli.TypedMsg('No venv template, creating the venv from scratch').warning)
+            return self._run(f'{shlex.quote(self.python)} -m venv {shlex.quote(path)}')
+
+        with trace.tracer.span(f'VenvTemplate.clone {path}', 'venv'):
+            with self._locked(fcntl.LOCK_SH):
+                info = json.read(self._info_path)
+                if not info or not fs.clone(self.path, path, hardlink=False): return False
+
+            try:
+                os.remove(f'{path}/{TEMPLATE_FILE_NAME}')
+                for name in PREFIX_FILES:
+                    self._fix_prefix(f'{path}/{name}', info['prefix'].encode(), path.encode())
+            except OSError as error:
+                print(error)
+                fs.remove(path)
+                return False
+
+        return True
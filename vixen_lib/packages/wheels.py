@@ -0,0 +1,64 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen packages wheels cache.
+License           : GPL3
+"""
+
+import os
+from ..tools import fingerprint
+
+WHEELS_DIRECTORY = '/var/opt/vixen/wheels'
+IGNORED_NAMES = {'build', 'dist', '.venv', 'venv'}
+IGNORED_SUFFIXES = ('.egg-info',)
+
+def is_ignored(name: str) -> bool:
+    if fingerprint.is_ignored(name): return True
+    return name in IGNORED_NAMES or name.endswith(IGNORED_SUFFIXES)
+
+def source_hash(path: str) -> str:
+    return fingerprint.tree_fingerprint(path, fingerprint.Method.CONTENT, is_ignored)
+
+class WheelCache:
+    """Wheels of a package and of its dependencies, built once per source
+    tree hash and installed without network access afterwards.
+
+    Commands are meant to run with the target environment activated.
+    The source tree is hashed on the first use of the key, not before.
+    """
+
+    def __init__(self, package: str, source: str, directory: str = WHEELS_DIRECTORY) -> None:
+        self.package = package
+        self.source = source
+        self.parent_directory = f'{directory}/{package}'
+        self._key: str|None = None
+
+    @property
+    def key(self) -> str:
+        if self._key is None: self._key = source_hash(self.source)
+        return self._key
+
+    @property
+    def path(self) -> str:
+        return f'{self.parent_directory}/{self.key}'
+
+    @property
+    def is_cached(self) -> bool:
+        return os.path.isdir(self.path)
+
+    @property
+    def build_command(self) -> str:
+        temporary_path = f'{self.path}.tmp'
+        return (
+            f"([ -d {self.path} ] || ("
+            f"rm -rf {temporary_path} && mkdir -p {self.parent_directory} && "
+            f"pip wheel --wheel-dir {temporary_path} {self.source} && "
+            f"mv {temporary_path} {self.path} && "
+            f"find {self.parent_directory} -mindepth 1 -maxdepth 1 ! -name {self.key} -exec rm -rf {{}} +"
+            f"))"
+        )
+
+    @property
+    def install_command(self) -> str:
+        return f"pip install --no-index --find-links {self.path} {self.package}"
@@ -6,4 +6,5 @@ Description       : vixen snapshots feature.
 License           : GPL3
 """
 
-from .core import SnapShot
\ No newline at end of file
+from .core import SnapShot, SnapMode
+from .catalog import Catalog
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen snapshots compressed archives.
+License           : GPL3
+"""
+
+import os, shutil, tarfile, subprocess
+from typing import Dict, List, Optional
+from ..tools import fs, json, cli, trace
+
+COMPRESSORS = {
+    'zstd': {
+        'extension': 'tar.zst',
+        'compress': ['zstd', '-T0', '-3', '-q', '-c'],
+        'decompress': ['zstd', '-d', '-q', '-c']
+    },
+    'xz': {
+        'extension': 'tar.xz',
+        'compress': ['xz', '-T0', '-1', '-c'],
+        'decompress': ['xz', '-d', '-c']
+    }
+}
+
+def find_compressor(preferred: Optional[str|None] = None) -> str|None:
+    """Returns the first available compressor, None meaning the single
+    threaded xz implementation of the standard library."""
+    names = [preferred] if preferred else list(COMPRESSORS)
+
+    for name in names:
+        if name in COMPRESSORS and shutil.which(COMPRESSORS[name]['compress'][0]):
+            return name
+
+    return None
+
+def member_name(path: str) -> str:
+    return path.lstrip('/')
+
+class Archive:
+    """A single compressed tar stream holding every snapshot entry.
+
+    Compression runs in an external multi-threaded zstd/xz process fed
+    through a pipe. The index written next to the archive stores the
+    member count of each entry in archive order, so extracting one entry
+    stops reading the stream as soon as its last member is out.
+    """
+
+    def __init__(
+        self,
+        parent_directory: str,
+        snapshot_id: str,
+        compressor: Optional[str|None] = None
+    ) -> None:
+        self._compressor = find_compressor(compressor)
+        extension = COMPRESSORS[self._compressor]['extension'] if self._compressor else 'tar.xz'
+
+        self.path = f'{parent_directory}/{snapshot_id}.{extension}'
+        self.index_path = f'{parent_directory}/{snapshot_id}.index.json'
+        self._index: Dict[str, dict] = {}
+        self._tar: tarfile.TarFile|None = None
+        self._process: subprocess.Popen|None = None
+        self._output = None
+
+    def open(self) -> None:
+        if not self._compressor:
+            self._tar = tarfile.open(self.path, 'w|xz', format=tarfile.PAX_FORMAT)
+            return
+
+        self._output = open(self.path, 'wb')
+        self._process = subprocess.Popen(
+            COMPRESSORS[self._compressor]['compress'],
+            stdin=subprocess.PIPE,
+            stdout=self._output
+        )
+        self._tar = tarfile.open(
+            fileobj=self._process.stdin, mode='w|', format=tarfile.PAX_FORMAT
+        )
+
+    def add(self, path: str) -> None:
+        entry = {'members': 0, 'bytes': 0}
+
+        def count(member: tarfile.TarInfo) -> tarfile.TarInfo:
+            entry['members'] += 1
+            entry['bytes'] += member.size
+            return member
+
+        self._tar.add(path, arcname=member_name(path), filter=count)
+        self._index[path] = entry
+        trace.tracer.add_bytes(entry['bytes'])
+
+    def close(self) -> bool:
+        self._tar.close()
+
+        if self._process:
+            self._process.stdin.close()
+            result = self._process.wait() == 0
+            self._output.close()
+            if not result: return False
+
+        return json.write(self.index_path, {'entries': self._index})
+
+    def abort(self) -> None:
+        """Stops writing a failed archive, without its index."""
+        try: self._tar.close()
+        except (OSError, tarfile.TarError): pass
+
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._output.close()
+
+            try: self._process.stdin.close()
+            except OSError: pass
+
+        self.remove()
+
+    def _read_index(self) -> Dict[str, dict]:
+        if not self._index and fs.exists(self.index_path):
+            self._index = (json.read(self.index_path) or {}).get('entries', {})
+        return self._index
+
+    def _open_reader(self) -> tarfile.TarFile:
+        if not self._compressor:
+            return tarfile.open(self.path, 'r|xz')
+
+        self._process = subprocess.Popen(
+            COMPRESSORS[self._compressor]['decompress'] + [self.path],
+            stdout=subprocess.PIPE
+        )
+        return tarfile.open(fileobj=self._process.stdout, mode='r|')
+
+    def _close_reader(self, tar: tarfile.TarFile) -> None:
+        tar.close()
+
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+
+    def extract(self, path: str) -> bool:
+        entry = self._read_index().get(path)
+        if not entry: return False
+
+        name = member_name(path)
+        remaining = entry['members']
+        directories: List[tarfile.TarInfo] = []
+        tar = self._open_reader()
+
+        try:
+            for member in tar:
+                if member.name != name and not member.name.startswith(f'{name}/'):
+                    continue
+
+                tar.extract(member, '/', set_attrs=not member.isdir(), filter='tar')
+                if member.isdir(): directories.append(member)
+
+                remaining -= 1
+                if remaining == 0: break
+        finally: self._close_reader(tar)
+
+        for member in reversed(directories):
+            os.chmod(f'/{member.name}', member.mode)
+            os.utime(f'/{member.name}', (member.mtime, member.mtime))
+
+        return remaining == 0
+
+    def remove(self) -> bool:
+        for path in (self.path, self.index_path):
+            if fs.exists(path) and not fs.remove(path): return False
+        return True
+
+class ArchiveSnap:
+    def __init__(self, original_path: str, archive: Archive) -> None:
+        self.__original = fs.File(original_path)
+        self.__archive = archive
+
+    @property
+    def path(self) -> str:
+        return self.__original.path
+
+    def __message(self, message: str) -> cli.CheckMsg:
+        prompt = cli.TypedMsg(f"    Snap {self.__original.path} : ").warning
+        return cli.CheckMsg(f"{prompt}{message}")
+
+    def create(self) -> bool:
+        try:
+            self.__archive.add(self.__original.path)
+        except (OSError, tarfile.TarError) as error:
+            print(error)
+            print(self.__message('created').failure)
+            return False
+
+        print(self.__message('created').success)
+        return True
+
+    def restore(self) -> bool:
+        if self.__original.exists and not self.__original.remove(): return False
+
+        try:
+            result = self.__archive.extract(self.__original.path)
+        except (OSError, tarfile.TarError) as error:
+            print(error)
+            result = False
+
+        if not result:
+            print(self.__message('restored').failure)
+            return False
+
+        print(self.__message('restored').success)
+        return True
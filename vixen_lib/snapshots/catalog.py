@@ -0,0 +1,234 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen snapshots catalog and retention.
+License           : GPL3
+"""
+
+import os, re, stat
+from datetime import datetime
+from typing import Collection, Dict, List, Tuple
+from ..tools import fs, json
+from .store import Store, scan
+
+CATALOG_FILE_NAME = 'catalog.json'
+ID_PATTERN = re.compile(r'^\d{8}_\d{6}(_\d{6}_\d+)?$')
+ARCHIVE_PATTERN = re.compile(r'^(\d{8}_\d{6}(?:_\d{6}_\d+)?)\.(?:tar\.\w+|index\.json)$')
+
+class SnapStatus:
+    PENDING: str = 'pending'
+    COMPLETE: str = 'complete'
+
+def new_id() -> str:
+    """Time ordered snapshot id, unique across processes and runs."""
+    return f'{datetime.now():%Y%m%d_%H%M%S_%f}_{os.getpid()}'
+
+def is_running(pid: int|None) -> bool:
+    if not pid: return False
+
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+
+    return True
+
+def disk_usage(path: str) -> int:
+    """Bytes allocated to `path`, skipping the files whose inode is shared
+    through a hard link (clone snapshots share them with the live tree)."""
+    if not os.path.lexists(path): return 0
+
+    usage = 0
+    seen = set()
+
+    for _, path_stat in scan(path):
+        if path_stat.st_nlink > 1 and not stat.S_ISDIR(path_stat.st_mode): continue
+        if (path_stat.st_dev, path_stat.st_ino) in seen: continue
+
+        seen.add((path_stat.st_dev, path_stat.st_ino))
+        usage += path_stat.st_blocks * 512
+
+    return usage
+
+class Catalog:
+    """Every snapshot of a parent directory: its mode, the paths it owns,
+    the process which created it and the bytes it holds.
+
+    A snapshot stays `pending` until its creation is committed. Snapshots
+    whose process is gone are orphans: the retention policy keeps the
+    newest complete ones within `keep_last` and `max_bytes` and removes the
+    others. Files of the parent directory missing from the catalog (older
+    vxm versions) are treated as interrupted snapshots.
+
+    The catalog is only written under the packages state lock.
+    """
+
+    def __init__(self, parent_directory: str) -> None:
+        self.parent_directory = parent_directory
+        self.path = f'{parent_directory}/{CATALOG_FILE_NAME}'
+        self._store = Store(parent_directory)
+
+    def _read(self) -> Dict[str, dict]:
+        if not fs.exists(self.path): return {}
+        return (json.read(self.path) or {}).get('snapshots', {})
+
+    def _write(self, records: Dict[str, dict]) -> bool:
+        return json.write(self.path, {'snapshots': records})
+
+    @property
+    def records(self) -> Dict[str, dict]:
+        return self._read()
+
+    def add(self, snapshot_id: str, mode: str, paths: List[str]) -> bool:
+        records = self._read()
+        records[snapshot_id] = {
+            'mode': mode,
+            'status': SnapStatus.PENDING,
+            'pid': os.getpid(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'paths': paths,
+            'bytes': 0
+        }
+        return self._write(records)
+
+    def complete(self, snapshot_id: str, size: int) -> bool:
+        records = self._read()
+        if snapshot_id not in records: return False
+
+        records[snapshot_id].update({'status': SnapStatus.COMPLETE, 'bytes': size})
+        return self._write(records)
+
+    def discard(self, snapshot_id: str) -> bool:
+        records = self._read()
+        if records.pop(snapshot_id, None) is None: return True
+        return self._write(records)
+
+    def _untracked(self, records: Dict[str, dict]) -> Dict[str, dict]:
+        untracked: Dict[str, dict] = {}
+
+        def adopt(snapshot_id: str, path: str) -> None:
+            if snapshot_id in records: return
+            record = untracked.setdefault(snapshot_id, {
+                'mode': None,
+                'status': SnapStatus.PENDING,
+                'pid': None,
+                'paths': [],
+                'bytes': 0
+            })
+            record['paths'].append(path)
+
+        if fs.is_directory(self.parent_directory):
+            for name in os.listdir(self.parent_directory):
+                path = f'{self.parent_directory}/{name}'
+
+                if ID_PATTERN.match(name) and fs.is_directory(path): adopt(name, path)
+                elif match := ARCHIVE_PATTERN.match(name): adopt(match.group(1), path)
+
+        staging_directory = f'{self.parent_directory}/staging'
+        if fs.is_directory(staging_directory):
+            for name in os.listdir(staging_directory):
+                if ID_PATTERN.match(name): adopt(name, f'{staging_directory}/{name}')
+
+        if fs.is_directory(self._store.manifests_directory):
+            for name in os.listdir(self._store.manifests_directory):
+                snapshot_id, extension = os.path.splitext(name)
+                if extension == '.json' and ID_PATTERN.match(snapshot_id):
+                    adopt(snapshot_id, self._store.manifest_path(snapshot_id))
+
+        return untracked
+
+    def orphans(self) -> List[Tuple[str, dict]]:
+        """Snapshots whose process is gone, newest first."""
+        records = self._read()
+        records.update(self._untracked(records))
+
+        return sorted(
+            (
+                (snapshot_id, record) for snapshot_id, record in records.items()
+                if not is_running(record['pid'])
+            ),
+            key=lambda item: item[0],
+            reverse=True
+        )
+
+    def plan(self, keep_last: int, max_bytes: int, pinned: Collection[str] = ()) -> List[str]:
+        """Ids of the orphaned snapshots the retention policy removes.
+        Pinned snapshots (kept for an interrupted run) are never removed."""
+        return self._retention(keep_last, max_bytes, pinned)[0]
+
+    def drops_index(self, keep_last: int, max_bytes: int, pinned: Collection[str] = ()) -> bool:
+        """The objects only the store index refers to don't fit in
+        `max_bytes` next to the kept snapshots."""
+        kept_bytes = self._retention(keep_last, max_bytes, pinned)[1]
+        return kept_bytes + self._store.indexed_bytes() > max_bytes
+
+    def _retention(self, keep_last: int, max_bytes: int, pinned: Collection[str]) -> Tuple[List[str], int]:
+        removed = []
+        kept, kept_bytes = 0, 0
+
+        for snapshot_id, record in self.orphans():
+            if snapshot_id in pinned: continue
+
+            if (
+                record['status'] == SnapStatus.COMPLETE
+                and kept < keep_last
+                and kept_bytes + record['bytes'] <= max_bytes
+            ):
+                kept += 1
+                kept_bytes += record['bytes']
+                continue
+
+            removed.append(snapshot_id)
+
+        return removed, kept_bytes
+
+    def _remove_paths(self, paths: List[str]) -> Tuple[bool, int]:
+        freed = 0
+
+        for path in paths:
+            if not os.path.lexists(path): continue
+
+            size = disk_usage(path)
+            if not fs.remove(path): return False, freed
+            freed += size
+
+        return True, freed
+
+    def collect(self, keep_last: int, max_bytes: int, pinned: Collection[str] = ()) -> dict:
+        orphans = dict(self.orphans())
+        report = {'removed': 0, 'failed': 0, 'freed': 0}
+        records = self._read()
+        has_manifests = False
+
+        for snapshot_id in self.plan(keep_last, max_bytes, pinned):
+            paths = orphans[snapshot_id]['paths']
+            result, freed = self._remove_paths(paths)
+            report['freed'] += freed
+
+            if not result:
+                report['failed'] += 1
+                continue
+
+            has_manifests |= any(
+                os.path.dirname(path) == self._store.manifests_directory for path in paths
+            )
+            records.pop(snapshot_id, None)
+            report['removed'] += 1
+
+        drops_index = self.drops_index(keep_last, max_bytes, pinned)
+        if has_manifests or drops_index:
+            report['freed'] += self._store.collect_garbage(keep_indexed=not drops_index)
+        if report['removed']: self._write(records)
+
+        report.update(self.usage())
+        return report
+
+    def usage(self) -> dict:
+        """Snapshots count and bytes, plus the size of the shared store."""
+        records = self._read()
+
+        return {
+            'snapshots': len(records),
+            'bytes': sum(record['bytes'] for record in records.values()),
+            'store_bytes': disk_usage(self._store.objects_directory)
+        }
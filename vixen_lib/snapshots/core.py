@@ -6,12 +6,31 @@ Description       : vixen snapshots feature.
 License           : GPL3
 """
 
-from typing import List
-from datetime import datetime
-from ..tools import fs, cli
+from enum import Enum
+from typing import List, Optional
+from ..tools import fs, cli, trace
+from .store import Store, StoreSnap
+from .lazy import LazyStore
+from .archive import Archive, ArchiveSnap
+from .catalog import Catalog, new_id, disk_usage
+
+class SnapMode(Enum):
+    COPY = 'copy'
+    CLONE = 'clone'
+    STORE = 'store'
+    ARCHIVE = 'archive'
+    LAZY = 'lazy'
+
+STORE_MODES = (SnapMode.STORE, SnapMode.LAZY)
 
 class Snap:
-    def __init__(self, original_path: str, snapshot_directory: str) -> None:
+    def __init__(
+        self,
+        original_path: str,
+        snapshot_directory: str,
+        mode: SnapMode = SnapMode.COPY
+    ) -> None:
+        self.__mode = mode
         self.__original = fs.File(original_path)
         self.__snap = fs.File(
             name=self.__original.name,
@@ -22,6 +41,17 @@ class Snap:
     def __message(self, message: str) -> cli.CheckMsg:
         prompt = cli.TypedMsg(f"    Snap {self.__original.path} : ").warning
         return cli.CheckMsg(f"{prompt}{message}")
+
+    @property
+    def path(self) -> str:
+        return self.__original.path
+
+    def __transfer(self, source: fs.File, to: str) -> bool:
+        if self.__mode == SnapMode.CLONE:
+            # Files written in place would change a snap sharing their
+            # inode: without reflinks, the snap is a copy.
+            return source.clone(to=to, hardlink=False)
+        return source.copy(to=to)
     
     def create(self) -> bool:
         if self.__snap.exists: return False
@@ -29,7 +59,7 @@ class Snap:
         if not self.__snap.parent_directory_exists:
             if not self.__snap.create_parent_directory(): return False
 
-        if not self.__original.copy(to=self.__snap.parent_directory):
+        if not self.__transfer(self.__original, self.__snap.parent_directory):
             print(self.__message('created').failure)
             return False
         
@@ -40,7 +70,7 @@ class Snap:
         if not self.__snap.exists: return False
         if not self.__original.remove(): return False
 
-        if not self.__snap.copy(to=self.__original.parent_directory):
+        if not self.__transfer(self.__snap, self.__original.parent_directory):
             print(self.__message('restored').failure)
             return False
 
@@ -48,28 +78,141 @@ class Snap:
         return True
     
 class SnapShot:
-    def __init__(self, parent_directory: str, entries: List[str]) -> None:
-        self.__snaps: List[Snap] = []
+    def __init__(
+        self,
+        parent_directory: str,
+        entries: List[str],
+        mode: SnapMode = SnapMode.COPY,
+        verify_hash: bool = False,
+        snapshot_id: Optional[str|None] = None
+    ) -> None:
+        """A new snapshot, or the existing one `snapshot_id` (left by an
+        interrupted run), which can only be restored or removed."""
+        self.__snaps: List[Snap|StoreSnap|ArchiveSnap] = []
+        self.__mode = mode
+        self.__id = snapshot_id or new_id()
+        self.__is_attached = snapshot_id is not None
+        self.__catalog = Catalog(parent_directory)
+
+        if mode in STORE_MODES:
+            self.__init_store(parent_directory, entries, verify_hash)
+        elif mode == SnapMode.ARCHIVE:
+            self.__init_archive(parent_directory, entries)
+        else:
+            self.__init_directory(parent_directory, entries, mode)
+
+        if fs.exists(parent_directory) and not self.__is_attached:
+            self.__catalog.add(self.__id, mode.value, self.__paths)
+
+    @property
+    def id(self) -> str:
+        return self.__id
+
+    def __init_directory(
+        self,
+        parent_directory: str,
+        entries: List[str],
+        mode: SnapMode
+    ) -> None:
         self.__snapshot_directory = fs.File(
-            name=datetime.now().strftime("%Y%m%d_%H%M%S"),
+            name=self.__id,
             parent_directory=parent_directory,
             file_type=fs.FileType.DIRECTORY
         )        
-        self.__snapshot_directory.create()
+        if not self.__is_attached: self.__snapshot_directory.create()
 
         if self.__snapshot_directory.exists:
             for entry in entries:
-                self.__snaps.append(Snap(entry, self.__snapshot_directory.path))
+                self.__snaps.append(
+                    Snap(entry, self.__snapshot_directory.path, mode)
+                )
+
+    def __init_store(
+        self,
+        parent_directory: str,
+        entries: List[str],
+        verify_hash: bool
+    ) -> None:
+        if self.__mode == SnapMode.LAZY:
+            self.__store = LazyStore(parent_directory, self.__id, verify_hash)
+        else:
+            self.__store = Store(parent_directory, verify_hash)
+        self.__manifest = (self.__is_attached and self.__store.read_manifest(self.__id)) or {}
+
+        if self.__store.init():
+            for entry in entries:
+                self.__snaps.append(StoreSnap(entry, self.__store, self.__manifest))
+
+    def __init_archive(self, parent_directory: str, entries: List[str]) -> None:
+        self.__archive = Archive(parent_directory, self.__id)
+
+        if self.__is_attached or fs.create(parent_directory, fs.FileType.DIRECTORY):
+            for entry in entries:
+                self.__snaps.append(ArchiveSnap(entry, self.__archive))
+
+    @property
+    def __paths(self) -> List[str]:
+        if self.__mode == SnapMode.LAZY:
+            return [self.__store.manifest_path(self.__id), self.__store.staging_directory]
+
+        if self.__mode == SnapMode.STORE:
+            return [self.__store.manifest_path(self.__id)]
+
+        if self.__mode == SnapMode.ARCHIVE:
+            return [self.__archive.path, self.__archive.index_path]
+
+        return [self.__snapshot_directory.path]
+
+    @property
+    def size(self) -> int:
+        """Bytes held by the snapshot, new store objects included."""
+        size = sum(disk_usage(path) for path in self.__paths)
+        if self.__mode in STORE_MODES: size += self.__store.written_bytes
+        return size
+
+    def __traced(self, snap: Snap|StoreSnap|ArchiveSnap, action: str) -> bool:
+        with trace.tracer.span(f'Snap.{action} {snap.path}', 'snapshot'):
+            return getattr(snap, action)()
+
+    def __begin(self) -> bool:
+        if self.__mode != SnapMode.ARCHIVE: return True
+
+        try: self.__archive.open()
+        except OSError as error:
+            print(error)
+            return False
+
+        return True
+
+    def __commit(self) -> bool:
+        if self.__mode in STORE_MODES:
+            return self.__store.write_manifest(self.__id, self.__manifest)
+
+        if self.__mode == SnapMode.ARCHIVE:
+            return self.__archive.close()
+
+        return True
+
+    def __abort(self) -> None:
+        if self.__mode == SnapMode.ARCHIVE: self.__archive.abort()
 
     def create(self) -> bool:
         purpose = 'Create snapshot'
         print(f"\n{purpose} :")
 
-        for snap in self.__snaps:
-            if not snap.create():
-                print(f"{cli.CheckMsg(purpose).failure}\n")
-                return False
+        if not self.__begin():
+            print(f"{cli.CheckMsg(purpose).failure}\n")
+            return False
+
+        result = all(self.__traced(snap, 'create') for snap in self.__snaps)
 
+        if not result: self.__abort()
+
+        if not result or not self.__commit():
+            print(f"{cli.CheckMsg(purpose).failure}\n")
+            return False
+
+        self.__catalog.complete(self.__id, self.size)
         print(f"{cli.CheckMsg(purpose).success}\n")
         return True
     
@@ -78,7 +221,7 @@ class SnapShot:
         print(f"\n{purpose} :")
 
         for snap in self.__snaps:
-            if not snap.restore():
+            if not self.__traced(snap, 'restore'):
                 print(f"{cli.CheckMsg(purpose).failure}\n")
                 return False
 
@@ -87,9 +230,19 @@ class SnapShot:
     
     def remove(self) -> bool:
         purpose = 'Remove Snapshot'
-        if not self.__snapshot_directory.remove():
+
+        with trace.tracer.span('SnapShot.remove', 'snapshot'):
+            if self.__mode in STORE_MODES:
+                result = self.__store.remove_manifest(self.__id)
+            elif self.__mode == SnapMode.ARCHIVE:
+                result = self.__archive.remove()
+            else:
+                result = self.__snapshot_directory.remove()
+
+        if not result:
             print(f"{cli.CheckMsg(purpose).failure}")
             return False
 
+        self.__catalog.discard(self.__id)
         print(f"{cli.CheckMsg(purpose).success}")
         return True
\ No newline at end of file
@@ -0,0 +1,237 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen lazy snapshots, pre-images taken on first write.
+License           : GPL3
+"""
+
+import os, ctypes, struct, select, shutil, platform, threading
+from typing import Dict, List, Tuple
+from ..tools import fs, cli
+from .store import Store
+
+FAN_CLOEXEC = 0x01
+FAN_CLASS_CONTENT = 0x04
+FAN_REPORT_TID = 0x100
+FAN_MARK_ADD = 0x01
+FAN_OPEN_PERM = 0x10000
+FAN_EVENT_ON_CHILD = 0x08000000
+FAN_ALLOW = 0x01
+FAN_DENY = 0x02
+AT_FDCWD = -100
+EVENT_METADATA = struct.Struct('=IBBHQii')
+RESPONSE = struct.Struct('=iI')
+READ_SIZE = 1 << 20
+
+# Syscalls which may open a file, with the index of their flags argument.
+# None means the file is opened for execution, never for writing.
+OPEN_SYSCALLS = {
+    'x86_64': {2: 1, 85: -1, 257: 2, 59: None, 322: None},
+    'aarch64': {56: 2, 221: None, 281: None}
+}
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_TRUNC
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.fanotify_init.argtypes = [ctypes.c_uint, ctypes.c_uint]
+_libc.fanotify_mark.argtypes = [
+    ctypes.c_int, ctypes.c_uint, ctypes.c_uint64, ctypes.c_int, ctypes.c_char_p
+]
+
+def opens_for_write(tid: int) -> bool:
+    """Whether the open `tid` is blocked in may write the file. Unknown
+    syscalls and architectures count as writes."""
+    syscalls = OPEN_SYSCALLS.get(platform.machine())
+    if not syscalls: return True
+
+    try:
+        with open(f'/proc/{tid}/syscall') as file: fields = file.read().split()
+        number = int(fields[0])
+    except (OSError, ValueError, IndexError): return True
+
+    if number not in syscalls: return True
+    if syscalls[number] is None: return False
+    if syscalls[number] < 0: return True
+
+    return bool(int(fields[1 + syscalls[number]], 16) & WRITE_FLAGS)
+
+class Guard:
+    """Holds every open of the staged files until their pre-image is in
+    the store.
+
+    A fanotify open permission event blocks the opening process, so the
+    file is still untouched when it is copied. Files only opened for
+    reading or execution are let through without a copy.
+    """
+
+    def __init__(self, on_write) -> None:
+        self._on_write = on_write
+        self._fd = _libc.fanotify_init(
+            FAN_CLOEXEC | FAN_CLASS_CONTENT | FAN_REPORT_TID, os.O_RDONLY | os.O_LARGEFILE
+        )
+        self._stop_read, self._stop_write = -1, -1
+        self._thread: threading.Thread|None = None
+        self._marked = set()
+
+    @property
+    def is_available(self) -> bool:
+        return self._fd >= 0
+
+    def mark(self, directory: str) -> bool:
+        if directory in self._marked: return True
+
+        if _libc.fanotify_mark(
+            self._fd, FAN_MARK_ADD, FAN_OPEN_PERM | FAN_EVENT_ON_CHILD, AT_FDCWD, directory.encode()
+        ) != 0: return False
+
+        self._marked.add(directory)
+        return True
+
+    def start(self) -> None:
+        if self._thread or not self.is_available: return
+
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread:
+            os.write(self._stop_write, b'\0')
+            self._thread.join()
+            self._thread = None
+
+        for fd in (self._fd, self._stop_read, self._stop_write):
+            if fd >= 0: os.close(fd)
+        self._fd = self._stop_read = self._stop_write = -1
+
+    def _respond(self, fd: int, response: int) -> None:
+        os.write(self._fd, RESPONSE.pack(fd, response))
+        os.close(fd)
+
+    def _handle(self, fd: int, tid: int) -> None:
+        response = FAN_ALLOW
+
+        try:
+            if opens_for_write(tid) and not self._on_write(fd): response = FAN_DENY
+        finally: self._respond(fd, response)
+
+    def _watch(self) -> None:
+        while True:
+            ready, _, _ = select.select([self._fd, self._stop_read], [], [])
+            if self._stop_read in ready: return
+
+            buffer = os.read(self._fd, 4096)
+            offset = 0
+
+            while offset + EVENT_METADATA.size <= len(buffer):
+                length, _, _, _, _, fd, tid = EVENT_METADATA.unpack_from(buffer, offset)
+                if fd >= 0: self._handle(fd, tid)
+                offset += length
+
+class LazyStore(Store):
+    """Store whose snapshots copy nothing up front.
+
+    Files already in the store cost nothing. The others are hard linked
+    into a staging directory, which keeps their pre-image when a task
+    removes or replaces them, and are guarded until the snapshot is
+    restored or removed: the first write open copies the file into the
+    store before the write starts. Without fanotify (no CAP_SYS_ADMIN,
+    older kernels) or across file systems, files are captured like a
+    plain STORE snapshot. Writes which do not open the file (truncate)
+    are not seen.
+    """
+
+    def __init__(self, directory: str, snapshot_id: str, verify_hash: bool = False) -> None:
+        super().__init__(directory, verify_hash)
+        self.staging_directory = f'{directory}/staging/{snapshot_id}'
+        self._staged: Dict[Tuple[int, int], List[dict]] = {}
+        self._lock = threading.Lock()
+        self._guard = Guard(self._preserve)
+
+    def init(self) -> bool:
+        if not super().init(): return False
+        if not self._guard.is_available: return True
+        if not fs.create(self.staging_directory, fs.FileType.DIRECTORY): return False
+
+        # Running before the first mark: opens of guarded directories,
+        # including the ones done by the capture itself, need an answer.
+        self._guard.start()
+        return True
+
+    def _capture_file(self, record: dict, path: str, path_stat: os.stat_result) -> None:
+        known = self.index.get(path)
+        if known and known[:3] == [path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino]:
+            if fs.exists(self.object_path(known[3])):
+                record['hash'] = known[3]
+                return
+
+        staged_path = f'{self.staging_directory}/{path_stat.st_dev}_{path_stat.st_ino}'
+
+        # Captured by the store workers: hard links of one inode share
+        # their staged path. Neither call opens a file, the guard never
+        # waits on the lock.
+        with self._lock:
+            if self._guard.is_available and self._guard.mark(os.path.dirname(path)):
+                try:
+                    if not os.path.lexists(staged_path): os.link(path, staged_path)
+                    record['staged'] = staged_path
+                    self._staged.setdefault((path_stat.st_dev, path_stat.st_ino), []).append(record)
+                    return
+                except OSError as error:
+                    if error.errno not in fs.HARDLINK_UNSUPPORTED: raise
+
+        super()._capture_file(record, path, path_stat)
+
+    def _preserve(self, fd: int) -> bool:
+        """Copies the still untouched file behind `fd` into the store.
+        Reads through `fd` itself: opening the file would wait on the
+        guard."""
+        file_stat = os.fstat(fd)
+
+        with self._lock:
+            records = self._staged.pop((file_stat.st_dev, file_stat.st_ino), None)
+        if not records: return True
+
+        temporary_path = f'{self.objects_directory}/.{os.getpid()}.{threading.get_ident()}.tmp'
+
+        try:
+            with open(temporary_path, 'wb') as file:
+                offset = 0
+                while chunk := os.pread(fd, READ_SIZE, offset):
+                    file.write(chunk)
+                    offset += len(chunk)
+
+            digest = self._commit_object(temporary_path)
+            for record in records: record['hash'] = digest
+        except OSError as error:
+            print(cli.TypedMsg(f'Lazy snapshot : {error}').failure)
+            return False
+
+        return True
+
+    def _record_source(self, record: dict) -> str:
+        if 'hash' not in record: return record['staged']
+        return super()._record_source(record)
+
+    def _is_unchanged(self, path: str, path_stat: os.stat_result, record: dict) -> bool:
+        if 'hash' in record: return super()._is_unchanged(path, path_stat, record)
+
+        # Never opened for writing, so untouched while it is the same inode.
+        return (path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino) == (
+            record['size'], record['mtime_ns'], record['ino']
+        )
+
+    def restore(self, path: str, records: List[dict]) -> int:
+        self._guard.stop()
+        return super().restore(path, records)
+
+    def remove_manifest(self, snapshot_id: str) -> bool:
+        self._guard.stop()
+
+        if fs.exists(self.staging_directory):
+            try: shutil.rmtree(self.staging_directory)
+            except OSError as error:
+                print(cli.TypedMsg(str(error)).failure)
+                return False
+
+        return super().remove_manifest(snapshot_id)
@@ -0,0 +1,376 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen snapshots content addressed store.
+License           : GPL3
+"""
+
+import os, stat, shutil, hashlib, threading
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from ..tools import fs, json, cli
+
+HASH_ALGORITHM = 'sha256'
+
+class RecordType:
+    DIRECTORY: str = 'directory'
+    FILE: str = 'file'
+    SYMLINK: str = 'symlink'
+
+def record_type(path_stat: os.stat_result) -> str:
+    if stat.S_ISLNK(path_stat.st_mode): return RecordType.SYMLINK
+    if stat.S_ISDIR(path_stat.st_mode): return RecordType.DIRECTORY
+    return RecordType.FILE
+
+def scan(path: str, relative_path: str = '') -> Iterator[Tuple[str, os.stat_result]]:
+    """Yields (relative path, lstat) for `path` and everything below it,
+    parents before children. Symbolic links are never followed."""
+    path_stat = os.lstat(path)
+    yield relative_path, path_stat
+
+    if not stat.S_ISDIR(path_stat.st_mode): return
+
+    with os.scandir(path) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            yield from scan(entry.path, os.path.join(relative_path, entry.name))
+
+def hash_file(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, HASH_ALGORITHM).hexdigest()
+
+class Store:
+    """Hash keyed blobs shared by every snapshot, plus one manifest per
+    snapshot describing the entries it captured.
+
+    The index keeps the last known (size, mtime, inode) of every captured
+    file with its hash, so unchanged files are neither hashed nor written
+    again by the next snapshot. It is a cache: the objects only it refers
+    to count against the retention policy, which can drop them (the next
+    snapshot writes them again).
+
+    Files are ingested and restored on a pool of copy workers; the tree
+    walk, directories and symbolic links stay sequential.
+    """
+
+    def __init__(self, directory: str, verify_hash: bool = False, workers: int = 0) -> None:
+        self.directory = directory
+        self.verify_hash = verify_hash
+        self.objects_directory = f'{directory}/objects'
+        self.manifests_directory = f'{directory}/manifests'
+        self.index_path = f'{directory}/index.json'
+        self._index: Dict[str, list]|None = None
+        self._cloner = fs.Cloner(hardlink=False)
+        self._workers = workers or fs.get_copy_workers()
+        self._written_lock = threading.Lock()
+        self.written_bytes = 0
+
+    def init(self) -> bool:
+        for directory in (self.objects_directory, self.manifests_directory):
+            if not fs.create(directory, fs.FileType.DIRECTORY): return False
+        return True
+
+    def object_path(self, digest: str) -> str:
+        return f'{self.objects_directory}/{digest[:2]}/{digest[2:]}'
+
+    def manifest_path(self, snapshot_id: str) -> str:
+        return f'{self.manifests_directory}/{snapshot_id}.json'
+
+    @property
+    def index(self) -> Dict[str, list]:
+        if self._index is None:
+            self._index = (fs.exists(self.index_path) and json.read(self.index_path)) or {}
+        return self._index
+
+    def save_index(self) -> bool:
+        return json.write(self.index_path, self.index)
+
+    def _map(self, function: Callable, jobs: List[tuple]) -> list:
+        """Results of `function` over `jobs`, on the copy workers. The
+        first exception is raised once every started job is done."""
+        if self._workers < 2 or len(jobs) < 2: return [function(*job) for job in jobs]
+
+        # Loaded up front: workers only set entries of the shared index.
+        self.index
+
+        with ThreadPoolExecutor(self._workers, thread_name_prefix='store') as pool:
+            return list(pool.map(function, *zip(*jobs)))
+
+    def _ingest(self, path: str) -> str:
+        """Copies `path` into the objects and returns its hash."""
+        temporary_path = f'{self.objects_directory}/.{os.getpid()}.{threading.get_ident()}.tmp'
+        self._cloner(path, temporary_path)
+        return self._commit_object(temporary_path)
+
+    def _commit_object(self, temporary_path: str) -> str:
+        digest = hash_file(temporary_path)
+        object_path = self.object_path(digest)
+
+        if fs.exists(object_path):
+            os.remove(temporary_path)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            size = os.lstat(temporary_path).st_size
+            os.replace(temporary_path, object_path)
+            with self._written_lock: self.written_bytes += size
+
+        return digest
+
+    def _store_file(self, path: str, path_stat: os.stat_result) -> str:
+        known = self.index.get(path)
+        if known and known[:3] == [path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino]:
+            if fs.exists(self.object_path(known[3])): return known[3]
+
+        digest = self._ingest(path)
+        self.index[path] = [
+            path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino, digest
+        ]
+        return digest
+
+    def _capture_file(self, record: dict, path: str, path_stat: os.stat_result) -> None:
+        record['hash'] = self._store_file(path, path_stat)
+
+    def _prune_index(self, path: str, captured: Set[str]) -> None:
+        for indexed_path in list(self.index):
+            if indexed_path in captured: continue
+            if indexed_path == path or indexed_path.startswith(f'{path}/'):
+                del self.index[indexed_path]
+
+    def capture(self, path: str) -> List[dict]:
+        records = []
+        captured = set()
+        files = []
+
+        for relative_path, path_stat in scan(path):
+            full_path = os.path.join(path, relative_path) if relative_path else path
+            record = {
+                'path': relative_path,
+                'mode': stat.S_IMODE(path_stat.st_mode),
+                'mtime_ns': path_stat.st_mtime_ns
+            }
+
+            record['type'] = record_type(path_stat)
+
+            if record['type'] == RecordType.SYMLINK:
+                record['target'] = os.readlink(full_path)
+            elif record['type'] == RecordType.FILE:
+                record['size'] = path_stat.st_size
+                record['ino'] = path_stat.st_ino
+                files.append((record, full_path, path_stat))
+                captured.add(full_path)
+
+            records.append(record)
+
+        self._map(self._capture_file, files)
+        self._prune_index(path, captured)
+        return records
+
+    def _is_unchanged(self, path: str, path_stat: os.stat_result, record: dict) -> bool:
+        if path_stat.st_size != record['size']: return False
+        if path_stat.st_mtime_ns != record['mtime_ns']: return False
+
+        if self.verify_hash: return hash_file(path) == record['hash']
+        if path_stat.st_ino == record['ino']: return True
+
+        known = self.index.get(path)
+        return bool(known) and known == [
+            path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino, record['hash']
+        ]
+
+    def _record_source(self, record: dict) -> str:
+        return self.object_path(record['hash'])
+
+    def _write_record(self, path: str, record: dict) -> None:
+        self._cloner(self._record_source(record), path)
+        os.chmod(path, record['mode'])
+        os.utime(path, ns=(record['mtime_ns'], record['mtime_ns']))
+        if 'hash' not in record: return
+
+        path_stat = os.lstat(path)
+        self.index[path] = [
+            path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino, record['hash']
+        ]
+
+    def _remove_unexpected(
+        self,
+        path: str,
+        live: Dict[str, os.stat_result],
+        expected: Dict[str, dict]
+    ) -> Set[str]:
+        removed = set()
+
+        for relative_path, path_stat in live.items():
+            if relative_path and os.path.dirname(relative_path) in removed:
+                removed.add(relative_path)
+                continue
+
+            record = expected.get(relative_path)
+            if record and record['type'] == record_type(path_stat): continue
+
+            full_path = os.path.join(path, relative_path) if relative_path else path
+            if stat.S_ISDIR(path_stat.st_mode): shutil.rmtree(full_path)
+            else: os.remove(full_path)
+            removed.add(relative_path)
+
+        return removed
+
+    def _restore_file(self, path: str, path_stat: os.stat_result|None, record: dict) -> bool:
+        if path_stat and self._is_unchanged(path, path_stat, record):
+            if stat.S_IMODE(path_stat.st_mode) != record['mode']:
+                os.chmod(path, record['mode'])
+            return False
+
+        if path_stat: os.remove(path)
+        self._write_record(path, record)
+        return True
+
+    def restore(self, path: str, records: List[dict]) -> int:
+        """Brings `path` back to the state described by `records`, only
+        touching entries which differ from it. Returns the number of
+        entries removed, rewritten or recreated."""
+        live = dict(scan(path)) if os.path.lexists(path) else {}
+        expected = {record['path']: record for record in records}
+        removed = self._remove_unexpected(path, live, expected)
+        changes = len(removed)
+        directories = []
+        files = []
+
+        for record in records:
+            full_path = os.path.join(path, record['path']) if record['path'] else path
+            path_stat = None if record['path'] in removed else live.get(record['path'])
+
+            if record['type'] == RecordType.DIRECTORY:
+                if not path_stat:
+                    os.mkdir(full_path)
+                    changes += 1
+                directories.append((full_path, record))
+                continue
+
+            if record['type'] == RecordType.SYMLINK:
+                if path_stat and os.readlink(full_path) == record['target']: continue
+                if path_stat: os.remove(full_path)
+                os.symlink(record['target'], full_path)
+                changes += 1
+                continue
+
+            files.append((full_path, path_stat, record))
+
+        changes += sum(self._map(self._restore_file, files))
+
+        for full_path, record in reversed(directories):
+            os.chmod(full_path, record['mode'])
+            os.utime(full_path, ns=(record['mtime_ns'], record['mtime_ns']))
+
+        return changes
+
+    def write_manifest(self, snapshot_id: str, manifest: Dict[str, List[dict]]) -> bool:
+        if not json.write(self.manifest_path(snapshot_id), manifest): return False
+        return self.save_index()
+
+    def read_manifest(self, snapshot_id: str) -> Dict[str, List[dict]]|None:
+        if not fs.exists(self.manifest_path(snapshot_id)): return None
+        return json.read(self.manifest_path(snapshot_id))
+
+    def _manifest_objects(self) -> Set[str]:
+        digests = set()
+        if not fs.is_directory(self.manifests_directory): return digests
+
+        for name in os.listdir(self.manifests_directory):
+            manifest = json.read(f'{self.manifests_directory}/{name}') or {}
+            for records in manifest.values():
+                digests.update(record['hash'] for record in records if 'hash' in record)
+
+        return digests
+
+    def _indexed_objects(self) -> Set[str]:
+        """Objects only the index refers to."""
+        return {record[3] for record in self.index.values()} - self._manifest_objects()
+
+    def indexed_bytes(self) -> int:
+        size = 0
+
+        for digest in self._indexed_objects():
+            try: size += os.lstat(self.object_path(digest)).st_size
+            except FileNotFoundError: pass
+
+        return size
+
+    def collect_garbage(self, keep_indexed: bool = True) -> int:
+        """Removes the objects no manifest refers to, except the ones of
+        the index when `keep_indexed` is set. Dropped objects leave the
+        index."""
+        referenced = self._manifest_objects()
+        if keep_indexed: referenced.update(record[3] for record in self.index.values())
+        freed = 0
+
+        if not fs.is_directory(self.objects_directory): return freed
+
+        for prefix in os.listdir(self.objects_directory):
+            prefix_directory = f'{self.objects_directory}/{prefix}'
+            if not fs.is_directory(prefix_directory): continue
+
+            for name in os.listdir(prefix_directory):
+                if prefix + name in referenced: continue
+                object_path = f'{prefix_directory}/{name}'
+                freed += os.lstat(object_path).st_size
+                os.remove(object_path)
+
+        if not keep_indexed:
+            for path, record in list(self.index.items()):
+                if record[3] not in referenced: del self.index[path]
+            if not self.save_index(): raise OSError(f'Unable to write {self.index_path}')
+
+        return freed
+
+    def remove_manifest(self, snapshot_id: str) -> bool:
+        if fs.exists(self.manifest_path(snapshot_id)):
+            if not fs.remove(self.manifest_path(snapshot_id)): return False
+
+        try: self.collect_garbage()
+        except OSError as error:
+            print(cli.TypedMsg(str(error)).failure)
+            return False
+
+        return True
+
+class StoreSnap:
+    def __init__(self, original_path: str, store: Store, manifest: Dict[str, List[dict]]) -> None:
+        self.__original = fs.File(original_path)
+        self.__store = store
+        self.__manifest = manifest
+
+    @property
+    def path(self) -> str:
+        return self.__original.path
+
+    def __message(self, message: str) -> cli.CheckMsg:
+        prompt = cli.TypedMsg(f"    Snap {self.__original.path} : ").warning
+        return cli.CheckMsg(f"{prompt}{message}")
+
+    def create(self) -> bool:
+        if self.__original.path in self.__manifest: return False
+
+        try:
+            self.__manifest[self.__original.path] = self.__store.capture(self.__original.path)
+        except OSError as error:
+            print(error)
+            print(self.__message('created').failure)
+            return False
+
+        print(self.__message('created').success)
+        return True
+
+    def restore(self) -> bool:
+        records = self.__manifest.get(self.__original.path)
+        if not records: return False
+
+        try:
+            changes = self.__store.restore(self.__original.path, records)
+            self.__store.save_index()
+        except OSError as error:
+            print(error)
+            print(self.__message('restored').failure)
+            return False
+
+        print(self.__message(f'restored ({changes} changes)').success)
+        return True
@@ -6,6 +6,10 @@ Description       : vixen environment tools.
 License           : GPL3
 """
 
-from . import cli
-from . import fs
-from . import json
\ No newline at end of file
+import importlib
+
+__all__ = ['bytecode', 'cli', 'fs', 'fingerprint', 'json', 'trace']
+
+def __getattr__(name: str):
+    if name in __all__: return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
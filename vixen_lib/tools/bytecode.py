@@ -0,0 +1,115 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen bytecode precompilation.
+License           : GPL3
+"""
+
+import os, sys, shlex, py_compile, importlib.util
+from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+BATCH_SIZE = 256
+HEADER_SIZE = 16
+
+class InvalidationMode(Enum):
+    TIMESTAMP = 'timestamp'
+    CHECKED_HASH = 'checked-hash'
+    UNCHECKED_HASH = 'unchecked-hash'
+
+HASH_FLAGS = {
+    InvalidationMode.TIMESTAMP: 0b00,
+    InvalidationMode.CHECKED_HASH: 0b11,
+    InvalidationMode.UNCHECKED_HASH: 0b01
+}
+
+def sources(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isfile(path) and path.endswith('.py'):
+            yield path
+            continue
+
+        for directory, directories, files in os.walk(path):
+            directories[:] = [name for name in directories if name != '__pycache__']
+
+            for name in files:
+                if name.endswith('.py'): yield os.path.join(directory, name)
+
+def is_fresh(source: str, mode: InvalidationMode) -> bool:
+    """The cached bytecode of `source` matches it and was written with
+    the invalidation `mode`."""
+    try:
+        with open(importlib.util.cache_from_source(source), 'rb') as file:
+            header = file.read(HEADER_SIZE)
+    except OSError: return False
+
+    if len(header) < HEADER_SIZE or header[:4] != importlib.util.MAGIC_NUMBER: return False
+    if int.from_bytes(header[4:8], 'little') != HASH_FLAGS[mode]: return False
+
+    if mode == InvalidationMode.TIMESTAMP:
+        source_stat = os.stat(source)
+        return header[8:16] == (
+            (int(source_stat.st_mtime) & 0xFFFFFFFF).to_bytes(4, 'little')
+            + (source_stat.st_size & 0xFFFFFFFF).to_bytes(4, 'little')
+        )
+
+    with open(source, 'rb') as file:
+        return header[8:16] == importlib.util.source_hash(file.read())
+
+def _compile_batch(batch: List[str], mode: InvalidationMode) -> Tuple[int, List[str]]:
+    compiled, failed = 0, []
+    invalidation_mode = py_compile.PycInvalidationMode[mode.name]
+
+    for source in batch:
+        try:
+            if is_fresh(source, mode): continue
+            py_compile.compile(source, doraise=True, invalidation_mode=invalidation_mode)
+            compiled += 1
+        except (OSError, py_compile.PyCompileError): failed.append(source)
+
+    return compiled, failed
+
+def is_current_interpreter(python: Optional[str|None]) -> bool:
+    if not python: return True
+    return os.path.realpath(python) == os.path.realpath(sys.executable)
+
+def compileall_command(python: str, paths: List[str], mode: InvalidationMode) -> str:
+    """Precompilation by another interpreter (another bytecode version)."""
+    quoted = ' '.join(shlex.quote(path) for path in paths)
+    return f'{shlex.quote(python)} -m compileall -q -j 0 --invalidation-mode {mode.value} {quoted}'
+
+def precompile(
+    paths: List[str],
+    mode: InvalidationMode = InvalidationMode.TIMESTAMP,
+    workers: Optional[int|None] = None
+) -> Tuple[int, List[str]]:
+    """Compiles the sources under `paths` whose cached bytecode is stale
+    or missing, in a pool of processes. Returns the count of compiled
+    files and the sources which failed to compile.
+
+    Hash based pycs stay valid when a snapshot restore or an image
+    import changes the modification times of unchanged sources.
+    """
+    batch: List[str] = []
+    compiled, failed = 0, []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+
+        for source in sources(paths):
+            batch.append(source)
+
+            if len(batch) == BATCH_SIZE:
+                futures.append(executor.submit(_compile_batch, batch, mode))
+                batch = []
+
+        if batch: futures.append(executor.submit(_compile_batch, batch, mode))
+
+        for future in futures:
+            batch_compiled, batch_failed = future.result()
+            compiled += batch_compiled
+            failed += batch_failed
+
+    return compiled, failed
@@ -6,8 +6,15 @@ Description       : vixen command line interface tools.
 License           : GPL3
 """
 
-import subprocess
-from typing import TypedDict
+import os, sys, time, shlex, signal, secrets, selectors, threading, subprocess
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, TypedDict
+
+SHELL = '/bin/sh'
+OUTPUT_TAIL_LINES = 50
+READ_CHUNK_SIZE = 1 << 16
+TERMINATE_GRACE_PERIOD = 5
 
 class TypedMsg:
     def __init__(self, message: str) -> None:
@@ -48,14 +55,418 @@ class Outputs(TypedDict):
     out: bool
     err: bool
 
+class Result:
+    def __init__(
+        self,
+        command: str,
+        returncode: int|None,
+        duration: float,
+        stdout_tail: List[str],
+        stderr_tail: List[str],
+        timed_out: bool = False
+    ) -> None:
+        self.command = command
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout_tail = stdout_tail
+        self.stderr_tail = stderr_tail
+        self.timed_out = timed_out
+
+    @property
+    def success(self) -> bool:
+        return self.returncode == 0
+
+    def __bool__(self) -> bool:
+        return self.success
+
+def _extend_tail(tail: deque, pending: bytes, chunk: bytes, echo) -> bytes:
+    if echo and chunk:
+        echo.write(chunk)
+        echo.flush()
+
+    lines = (pending + chunk).split(b'\n')
+    tail.extend(line.decode(errors='replace') for line in lines[:-1])
+    return lines[-1][-READ_CHUNK_SIZE:]
+
+async def _pump(stream: 'asyncio.StreamReader', tail: deque, echo) -> None:
+    pending = b''
+
+    while chunk := await stream.read(READ_CHUNK_SIZE):
+        pending = _extend_tail(tail, pending, chunk, echo)
+
+    if pending: tail.append(pending.decode(errors='replace'))
+
+class _ProcessGroups:
+    """Process groups of the running commands. Commands run in sessions
+    of their own, to be stopped with their children, so Ctrl-C reaches
+    them through vxm."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._groups = set()
+
+    def add(self, pid: int) -> None:
+        with self._lock: self._groups.add(pid)
+
+    def discard(self, pid: int) -> None:
+        with self._lock: self._groups.discard(pid)
+
+    def signal(self, signal_number: int) -> None:
+        with self._lock: groups = list(self._groups)
+
+        for pid in groups:
+            try: os.killpg(pid, signal_number)
+            except ProcessLookupError: pass
+
+_process_groups = _ProcessGroups()
+
+def _interrupt(signal_number: int, frame) -> None:
+    _process_groups.signal(signal.SIGINT)
+    signal.default_int_handler(signal_number, frame)
+
+@contextmanager
+def forwarded_interrupts():
+    """Forwards SIGINT to the running commands before raising
+    KeyboardInterrupt, within the context. Only the main thread can set
+    the handler: elsewhere, and in nested contexts, this does nothing."""
+    if (
+        threading.current_thread() is not threading.main_thread()
+        or signal.getsignal(signal.SIGINT) is not signal.default_int_handler
+    ):
+        yield
+        return
+
+    signal.signal(signal.SIGINT, _interrupt)
+
+    try: yield
+    finally: signal.signal(signal.SIGINT, signal.default_int_handler)
+
+def _signal_group(process: 'asyncio.subprocess.Process', signal_number: int) -> None:
+    try: os.killpg(process.pid, signal_number)
+    except ProcessLookupError: pass
+
+async def _stop(process: 'asyncio.subprocess.Process') -> None:
+    import asyncio
+    _signal_group(process, signal.SIGTERM)
+
+    try: await asyncio.wait_for(process.wait(), TERMINATE_GRACE_PERIOD)
+    except asyncio.TimeoutError:
+        _signal_group(process, signal.SIGKILL)
+        await process.wait()
+
+async def run_async(
+    command: str,
+    outputs: Outputs = {'out': False, 'err': True},
+    timeout: Optional[float|None] = None
+) -> Result:
+    """Runs a shell command, streaming its output line by line to the
+    terminal (according to `outputs`) and into bounded tails kept in
+    the result. The command is stopped on timeout or cancellation."""
+    # Imported here: asyncio is most of the import time of vxm, which
+    # does not run commands for every operation.
+    import asyncio
+    start = time.perf_counter()
+    stdout_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    timed_out = False
+
+    process = await asyncio.create_subprocess_exec(
+        SHELL, '-c', command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+    _process_groups.add(process.pid)
+
+    async def communicate() -> None:
+        await asyncio.gather(
+            _pump(process.stdout, stdout_tail, sys.stdout.buffer if outputs['out'] else None),
+            _pump(process.stderr, stderr_tail, sys.stderr.buffer if outputs['err'] else None)
+        )
+        await process.wait()
+
+    try: await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        await _stop(process)
+    except asyncio.CancelledError:
+        await _stop(process)
+        raise
+    finally: _process_groups.discard(process.pid)
+
+    return Result(
+        command,
+        None if timed_out else process.returncode,
+        time.perf_counter() - start,
+        list(stdout_tail),
+        list(stderr_tail),
+        timed_out
+    )
+
+async def run_many_async(
+    commands: List[str],
+    outputs: Outputs = {'out': False, 'err': True},
+    timeout: Optional[float|None] = None
+) -> List[Result]:
+    import asyncio
+    return await asyncio.gather(
+        *(run_async(command, outputs, timeout) for command in commands)
+    )
+
+class _SessionStream:
+    """Output of a session shell up to the end marker of a command. The
+    bytes which could start the marker are held back from the terminal."""
+
+    def __init__(self, marker: bytes, echo) -> None:
+        self.marker = marker
+        self.echo = echo
+        self.tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        self.trailer: bytes|None = None
+        self._buffer = b''
+        self._pending = b''
+
+    def feed(self, chunk: bytes) -> None:
+        if self.trailer is not None:
+            self.trailer += chunk
+            return
+
+        self._buffer += chunk
+        index = self._buffer.find(self.marker)
+
+        if not chunk:
+            output, self._buffer = self._buffer, b''
+        elif index < 0:
+            keep = len(self.marker) - 1
+            output, self._buffer = self._buffer[:-keep], self._buffer[-keep:]
+        else:
+            output, self.trailer = self._buffer[:index], self._buffer[index + len(self.marker):]
+            self._buffer = b''
+
+        self._pending = _extend_tail(self.tail, self._pending, output, self.echo)
+
+    @property
+    def is_complete(self) -> bool:
+        return self.trailer is not None and self.trailer.endswith(b'\n')
+
+    def close(self) -> List[str]:
+        if self._pending: self.tail.append(self._pending.decode(errors='replace'))
+        self._pending = b''
+        return list(self.tail)
+
+class Session:
+    """A long-lived shell running commands one after the other.
+
+    Each command runs in a subshell of the session, so `exit`, `cd` or
+    `set` in a command do not leak into the next one, and the exit status
+    comes back after a random marker on the shell outputs. A session
+    started with a `source` script (such as a venv `activate` script)
+    sources it once, for every command it runs afterwards.
+    """
+
+    def __init__(self, source: Optional[str|None] = None) -> None:
+        self.source = source
+        self._token = secrets.token_hex(16).encode()
+
+        # The shell reads its script from a pipe of its own, so commands
+        # keep the standard input of vxm.
+        script, control = os.pipe()
+        self._process = subprocess.Popen(
+            [SHELL, f'/dev/fd/{script}'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=(script,),
+            start_new_session=True
+        )
+        _process_groups.add(self._process.pid)
+        os.close(script)
+        self._control = os.fdopen(control, 'wb')
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process.poll() is None
+
+    def start(self, outputs: Outputs) -> Result:
+        """Sources the session script in the shell itself."""
+        command = f'. {shlex.quote(self.source)}' if self.source else ':'
+        return self._execute(command, outputs, None, False)
+
+    def _script(self, command: str, in_subshell: bool) -> bytes:
+        token = self._token.decode()
+        run = f'( eval {shlex.quote(command)}\n)' if in_subshell else f'eval {shlex.quote(command)}'
+
+        return (
+            f"{run}\n"
+            f"printf '\\n{token} %d\\n' $?\n"
+            f"printf '\\n{token}\\n' >&2\n"
+        ).encode()
+
+    def _stop(self) -> None:
+        for signal_number in (signal.SIGTERM, signal.SIGKILL):
+            try: os.killpg(self._process.pid, signal_number)
+            except ProcessLookupError: pass
+
+            try:
+                self._process.wait(TERMINATE_GRACE_PERIOD)
+                break
+            except subprocess.TimeoutExpired: pass
+
+        self.close()
+
+    def execute(
+        self,
+        command: str,
+        outputs: Outputs = {'out': False, 'err': True},
+        timeout: Optional[float|None] = None
+    ) -> Result:
+        return self._execute(command, outputs, timeout, True)
+
+    def _execute(
+        self,
+        command: str,
+        outputs: Outputs,
+        timeout: float|None,
+        in_subshell: bool
+    ) -> Result:
+        start = time.perf_counter()
+        marker = b'\n' + self._token
+        streams = {
+            self._process.stdout: _SessionStream(marker + b' ', sys.stdout.buffer if outputs['out'] else None),
+            self._process.stderr: _SessionStream(marker, sys.stderr.buffer if outputs['err'] else None)
+        }
+        returncode, timed_out = None, False
+
+        try:
+            self._control.write(self._script(command, in_subshell))
+            self._control.flush()
+        except OSError: streams = {}
+
+        with selectors.DefaultSelector() as selector:
+            for stream in streams: selector.register(stream, selectors.EVENT_READ)
+            deadline = None if timeout is None else start + timeout
+
+            while selector.get_map():
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    timed_out = True
+                    break
+
+                for key, _ in selector.select(remaining):
+                    chunk = os.read(key.fd, READ_CHUNK_SIZE)
+                    stream = streams[key.fileobj]
+                    stream.feed(chunk)
+
+                    if not chunk or stream.is_complete: selector.unregister(key.fileobj)
+
+        stdout = streams.get(self._process.stdout)
+        if timed_out: self._stop()
+        elif stdout and stdout.is_complete: returncode = int(stdout.trailer)
+        else: self.close()
+
+        return Result(
+            command,
+            returncode,
+            time.perf_counter() - start,
+            stdout.close() if stdout else [],
+            streams[self._process.stderr].close() if streams else [],
+            timed_out
+        )
+
+    def close(self) -> None:
+        for stream in (self._control, self._process.stdout, self._process.stderr):
+            try: stream.close()
+            except OSError: pass
+
+        try: self._process.wait(TERMINATE_GRACE_PERIOD)
+        except subprocess.TimeoutExpired: self._process.kill()
+        _process_groups.discard(self._process.pid)
+
+class SessionPool:
+    """Session shells shared by the commands of a setup run. A command
+    takes an idle session started with the same `source` script, or
+    starts one, so parallel commands get their own shell."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._idle: Dict[str|None, List[Session]] = {}
+
+    def _acquire(self, source: str|None) -> Session|None:
+        with self._lock:
+            idle = self._idle.get(source, [])
+            return idle.pop() if idle else None
+
+    def _release(self, session: Session) -> None:
+        with self._lock: self._idle.setdefault(session.source, []).append(session)
+
+    def execute(
+        self,
+        command: str,
+        outputs: Outputs = {'out': False, 'err': True},
+        timeout: Optional[float|None] = None,
+        source: Optional[str|None] = None
+    ) -> Result:
+        session = self._acquire(source)
+
+        if not session:
+            session = Session(source)
+            started = session.start(outputs)
+
+            if not started:
+                session.close()
+                return started
+
+        result = session.execute(command, outputs, timeout)
+        if session.is_alive and not result.timed_out: self._release(session)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle = {}
+
+        for session in sessions: session.close()
+
+_session_pool: SessionPool|None = None
+
+@contextmanager
+def sessions():
+    """Runs the commands executed within the context in session shells.
+    Nested contexts share the outer pool."""
+    global _session_pool
+
+    if _session_pool:
+        yield _session_pool
+        return
+
+    _session_pool = SessionPool()
+
+    try:
+        with forwarded_interrupts(): yield _session_pool
+    finally:
+        pool, _session_pool = _session_pool, None
+        pool.close()
+
+def execute(
+    command: str,
+    outputs: Outputs = {'out': False, 'err': True},
+    timeout: Optional[float|None] = None,
+    source: Optional[str|None] = None
+) -> Result:
+    if _session_pool: return _session_pool.execute(command, outputs, timeout, source)
+    if source: command = f'. {shlex.quote(source)} && {command}'
+
+    import asyncio
+    with forwarded_interrupts(): return asyncio.run(run_async(command, outputs, timeout))
+
+def run_many(
+    commands: List[str],
+    outputs: Outputs = {'out': False, 'err': True},
+    timeout: Optional[float|None] = None
+) -> List[Result]:
+    import asyncio
+    with forwarded_interrupts(): return asyncio.run(run_many_async(commands, outputs, timeout))
+
 def run(
     command: str,
     outputs: Outputs = {'out': False, 'err': True}
 ) -> bool:
-    if subprocess.run(
-        command,
-        stdout=subprocess.PIPE if not outputs['out'] else None,
-        stderr=subprocess.PIPE if not outputs['err'] else None,
-        shell=True
-    ).returncode == 0: return True
-    return False
\ No newline at end of file
+    return execute(command, outputs).success
\ No newline at end of file
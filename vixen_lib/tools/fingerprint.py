@@ -0,0 +1,71 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen file system fingerprints.
+License           : GPL3
+"""
+
+import os, hashlib
+from enum import Enum
+from typing import Callable, List
+
+class Method(Enum):
+    STAT = 'stat'
+    CONTENT = 'content'
+
+IGNORED_NAMES = {'__pycache__', '.git'}
+IGNORED_SUFFIXES = ('.pyc',)
+
+def is_ignored(name: str) -> bool:
+    return name in IGNORED_NAMES or name.endswith(IGNORED_SUFFIXES)
+
+def _update_entry(digest, path: str, method: Method) -> None:
+    path_stat = os.lstat(path)
+    digest.update(oct(path_stat.st_mode).encode())
+
+    if os.path.islink(path):
+        digest.update(os.readlink(path).encode())
+    elif method == Method.STAT:
+        digest.update(f'{path_stat.st_size}:{path_stat.st_mtime_ns}'.encode())
+    else:
+        with open(path, 'rb') as file:
+            digest.update(hashlib.file_digest(file, 'sha256').digest())
+
+def tree_fingerprint(
+    path: str,
+    method: Method = Method.STAT,
+    ignore: Callable[[str], bool] = is_ignored
+) -> str:
+    """Hash of a file or directory tree. The STAT method only reads
+    metadata (size, mtime, mode), the CONTENT method hashes every file."""
+    digest = hashlib.sha256()
+
+    if not os.path.lexists(path):
+        digest.update(b'missing')
+        return digest.hexdigest()
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        _update_entry(digest, path, method)
+        return digest.hexdigest()
+
+    for directory, directories, files in os.walk(path):
+        directories[:] = sorted(name for name in directories if not ignore(name))
+
+        for name in sorted(files):
+            if ignore(name): continue
+
+            file_path = os.path.join(directory, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            _update_entry(digest, file_path, method)
+
+    return digest.hexdigest()
+
+def fingerprint(paths: List[str], method: Method = Method.STAT) -> str:
+    digest = hashlib.sha256()
+
+    for path in paths:
+        digest.update(path.encode())
+        digest.update(tree_fingerprint(path, method).encode())
+
+    return digest.hexdigest()
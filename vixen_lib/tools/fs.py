@@ -6,15 +6,57 @@ Description       : vixen file system tools.
 License           : GPL3
 """
 
-import os
-from . import cli
+import os, sys, shutil, errno, fcntl, threading
+from . import cli, trace
 from enum import Enum
-from typing import Optional
+from typing import List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 
 class FileType(Enum):
     FILE = 'file'
     DIRECTORY = 'directory'
 
+class Backend(Enum):
+    SHELL = 'shell'
+    NATIVE = 'native'
+
+class CloneMethod(Enum):
+    REFLINK = 'reflink'
+    HARDLINK = 'hardlink'
+    COPY = 'copy'
+
+BACKEND_ENV_VAR = 'VIXEN_FS_BACKEND'
+COPY_WORKERS_ENV_VAR = 'VIXEN_COPY_WORKERS'
+COPY_BATCH_SIZE = 64
+COPY_CHUNK_SIZE = 1 << 30
+FICLONE = 0x40049409
+REFLINK_UNSUPPORTED = (
+    errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS
+)
+HARDLINK_UNSUPPORTED = (errno.EXDEV, errno.EPERM, errno.EMLINK)
+
+_backend = Backend(os.environ.get(BACKEND_ENV_VAR, Backend.NATIVE.value))
+
+def _available_cpus() -> int:
+    if hasattr(os, 'sched_getaffinity'): return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+_copy_workers = int(os.environ.get(COPY_WORKERS_ENV_VAR, min(8, _available_cpus())))
+
+def get_backend() -> Backend:
+    return _backend
+
+def set_backend(backend: Backend) -> None:
+    global _backend
+    _backend = backend
+
+def get_copy_workers() -> int:
+    return _copy_workers
+
+def set_copy_workers(workers: int) -> None:
+    global _copy_workers
+    _copy_workers = max(1, workers)
+
 def exists(path: str) -> bool:
     return os.path.exists(path)
 
@@ -28,32 +70,300 @@ def get_file_type(path: str) -> FileType:
     if is_file(path): return FileType.FILE
     if is_directory(path): return FileType.DIRECTORY
 
-def create(
-    path: str,
-    file_type: FileType = FileType.FILE,
-    outputs: cli.Outputs = {'out': False, 'err': True}
-) -> bool:
-    
+def _show_error(error: OSError, outputs: cli.Outputs) -> None:
+    if outputs['err']: print(error, file=sys.stderr)
+
+def _copy_content(source_fd: int, target_fd: int, size: int) -> None:
+    trace.tracer.add_bytes(size)
+    offset = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                sent = os.copy_file_range(
+                    source_fd, target_fd, min(COPY_CHUNK_SIZE, size - offset)
+                )
+                if sent == 0: break
+                offset += sent
+            return
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+
+    if hasattr(os, 'sendfile'):
+        try:
+            while offset < size:
+                sent = os.sendfile(
+                    target_fd, source_fd, offset, min(COPY_CHUNK_SIZE, size - offset)
+                )
+                if sent == 0: break
+                offset += sent
+            return
+        except OSError as error:
+            if error.errno not in (errno.ENOSYS, errno.EINVAL, errno.ENOTSOCK):
+                raise
+
+    os.lseek(source_fd, offset, os.SEEK_SET)
+    os.lseek(target_fd, offset, os.SEEK_SET)
+    while chunk := os.read(source_fd, 1 << 20):
+        os.write(target_fd, chunk)
+
+def _break_link(path: str) -> None:
+    try:
+        if os.lstat(path).st_nlink > 1: os.unlink(path)
+    except FileNotFoundError: pass
+
+def _write_file(path: str, to: str, writer) -> str:
+    _break_link(to)
+    source_fd = os.open(path, os.O_RDONLY)
+    try:
+        stat = os.fstat(source_fd)
+        target_fd = os.open(to, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.st_mode & 0o7777)
+        try:
+            writer(source_fd, target_fd, stat.st_size)
+            os.chmod(target_fd, stat.st_mode & 0o7777)
+            os.utime(target_fd, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        except OSError:
+            os.close(target_fd)
+            os.unlink(to)
+            raise
+        os.close(target_fd)
+    finally: os.close(source_fd)
+
+    return to
+
+def copy_file(path: str, to: str) -> str:
+    return _write_file(path, to, _copy_content)
+
+def reflink_file(path: str, to: str) -> str:
+    return _write_file(
+        path, to, lambda source_fd, target_fd, _: fcntl.ioctl(target_fd, FICLONE, source_fd)
+    )
+
+class Cloner:
+    """Copy function sharing file data with its source when possible.
+
+    Tries a reflink first, then a hard link, then a plain copy, and keeps
+    the first method the file system accepts for the following files.
+    Hard links share the inode with the source: they are only safe when
+    the source files are replaced rather than rewritten in place, which
+    is what pip, importlib and `copy_file` (which breaks links) do.
+    """
+
+    def __init__(self, hardlink: bool = True) -> None:
+        self.method = CloneMethod.REFLINK
+        self._hardlink = hardlink
+
+    def __call__(self, path: str, to: str) -> str:
+        if self.method == CloneMethod.REFLINK:
+            try: return reflink_file(path, to)
+            except OSError as error:
+                if error.errno not in REFLINK_UNSUPPORTED: raise
+                self.method = CloneMethod.HARDLINK if self._hardlink else CloneMethod.COPY
+
+        if self.method == CloneMethod.HARDLINK:
+            try:
+                _break_link(to)
+                os.link(path, to)
+                return to
+            except OSError as error:
+                if error.errno not in HARDLINK_UNSUPPORTED: raise
+                self.method = CloneMethod.COPY
+
+        return copy_file(path, to)
+
+class TreeCopier:
+    """Copies a directory tree with a pool of threads.
+
+    Each directory is a task which creates its subdirectories' tasks and
+    splits its files into batches, so small files are copied in parallel
+    instead of one after the other. Symbolic links are copied as links.
+    Modes and timestamps of the directories are set once everything
+    below them is written. Errors are collected and raised together as
+    a `shutil.Error`, like `shutil.copytree`; any other exception of a
+    worker is raised once the pool is done.
+
+    It backs `copy` and `clone` of directories (COPY and CLONE
+    snapshots) when more than one copy worker is available. STORE
+    snapshots spread their files over the same number of workers.
+    """
+
+    def __init__(self, copy_function = copy_file, workers: Optional[int|None] = None) -> None:
+        self._copy_function = copy_function
+        self._workers = workers or get_copy_workers()
+        self._pool: ThreadPoolExecutor|None = None
+        self._futures: List[Future] = []
+        self._spans: List[trace.Span] = []
+        self._directories: List[Tuple[str, os.stat_result]] = []
+        self._errors: List[Tuple[str, str, str]] = []
+        self._pending = 0
+        self._done = threading.Condition()
+
+    def __call__(self, path: str, to: str) -> str:
+        self._directories, self._errors, self._futures = [], [], []
+        self._spans = trace.tracer.context()
+        os.mkdir(to, 0o700)
+
+        with ThreadPoolExecutor(self._workers, thread_name_prefix='copy') as pool:
+            self._pool = pool
+            self._submit(self._copy_directory, path, to)
+            with self._done: self._done.wait_for(lambda: self._pending == 0)
+
+        self._pool = None
+        for future in self._futures: future.result()
+
+        source_stat = os.stat(path)
+        for directory, directory_stat in reversed([(to, source_stat)] + self._directories):
+            try:
+                os.chmod(directory, directory_stat.st_mode & 0o7777)
+                os.utime(directory, ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns))
+            except OSError as error: self._errors.append((path, directory, str(error)))
+
+        if self._errors: raise shutil.Error(self._errors)
+        return to
+
+    def _submit(self, function, *args) -> None:
+        with self._done: self._pending += 1
+        self._futures.append(self._pool.submit(self._run, function, *args))
+
+    def _run(self, function, *args) -> None:
+        try:
+            with trace.tracer.attach(self._spans): function(*args)
+        finally:
+            with self._done:
+                self._pending -= 1
+                if self._pending == 0: self._done.notify_all()
+
+    def _copy_directory(self, path: str, to: str) -> None:
+        files = []
+
+        try:
+            with os.scandir(path) as entries: entries = list(entries)
+        except OSError as error:
+            self._errors.append((path, to, str(error)))
+            return
+
+        for entry in entries:
+            target = os.path.join(to, entry.name)
+
+            try:
+                if entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), target)
+                    entry_stat = entry.stat(follow_symlinks=False)
+                    os.utime(
+                        target,
+                        ns=(entry_stat.st_atime_ns, entry_stat.st_mtime_ns),
+                        follow_symlinks=False
+                    )
+                elif entry.is_dir(follow_symlinks=False):
+                    os.mkdir(target, 0o700)
+                    self._directories.append((target, entry.stat(follow_symlinks=False)))
+                    self._submit(self._copy_directory, entry.path, target)
+                else: files.append((entry.path, target))
+            except OSError as error: self._errors.append((entry.path, target, str(error)))
+
+        for index in range(0, len(files), COPY_BATCH_SIZE):
+            self._submit(self._copy_files, files[index:index + COPY_BATCH_SIZE])
+
+    def _copy_files(self, files: List[Tuple[str, str]]) -> None:
+        for path, to in files:
+            try: self._copy_function(path, to)
+            except OSError as error: self._errors.append((path, to, str(error)))
+
+def _shell_create(path: str, file_type: FileType, outputs: cli.Outputs) -> bool:
     if file_type == FileType.FILE:
         return cli.run(f'touch {path}', outputs)
 
     if file_type == FileType.DIRECTORY:
         return cli.run(f'mkdir -p {path}', outputs)
 
+def _native_create(path: str, file_type: FileType, outputs: cli.Outputs) -> bool:
+    try:
+        if file_type == FileType.FILE:
+            with open(path, 'a'): os.utime(path)
+            return True
+
+        if file_type == FileType.DIRECTORY:
+            os.makedirs(path, exist_ok=True)
+            return True
+    except OSError as error: _show_error(error, outputs)
+
+    return False
+
+def _shell_copy(path: str, to: str, outputs: cli.Outputs) -> bool:
+    option = '-r ' if is_directory(path) else ''
+    return cli.run(f'cp {option}{path} {to}', outputs)
+
+def _native_copy(
+    path: str,
+    to: str,
+    outputs: cli.Outputs,
+    copy_function = copy_file
+) -> bool:
+    if is_directory(to): to = os.path.join(to, os.path.basename(path))
+
+    try:
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), to)
+        elif is_directory(path) and get_copy_workers() > 1:
+            TreeCopier(copy_function)(path, to)
+        elif is_directory(path):
+            shutil.copytree(path, to, symlinks=True, copy_function=copy_function)
+        else:
+            copy_function(path, to)
+        return True
+    except (OSError, shutil.Error) as error: _show_error(error, outputs)
+
+    return False
+
+def _shell_remove(path: str, outputs: cli.Outputs) -> bool:
+    option = '-r ' if is_directory(path) else ''
+    return cli.run(f'rm {option}{path}', outputs)
+
+def _native_remove(path: str, outputs: cli.Outputs) -> bool:
+    try:
+        if is_directory(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        return True
+    except OSError as error: _show_error(error, outputs)
+
+    return False
+
+def create(
+    path: str,
+    file_type: FileType = FileType.FILE,
+    outputs: cli.Outputs = {'out': False, 'err': True}
+) -> bool:
+    if _backend == Backend.SHELL:
+        return _shell_create(path, file_type, outputs)
+    return _native_create(path, file_type, outputs)
+
 def copy(
     path: str,
     to: str,
     outputs: cli.Outputs = {'out': False, 'err': True}
 ) -> bool:
-    option = '-r ' if is_directory(path) else ''
-    return cli.run(f'cp {option}{path} {to}', outputs)
+    if _backend == Backend.SHELL:
+        return _shell_copy(path, to, outputs)
+    return _native_copy(path, to, outputs)
+
+def clone(
+    path: str,
+    to: str,
+    hardlink: bool = True,
+    outputs: cli.Outputs = {'out': False, 'err': True}
+) -> bool:
+    return _native_copy(path, to, outputs, Cloner(hardlink))
 
 def remove(
     path: str,
     outputs: cli.Outputs = {'out': False, 'err': True}
 ) -> bool:
-    option = '-r ' if is_directory(path) else ''
-    return cli.run(f'rm {option}{path}', outputs)
+    if _backend == Backend.SHELL:
+        return _shell_remove(path, outputs)
+    return _native_remove(path, outputs)
 
 class File:
     def __init__(
@@ -120,6 +430,19 @@ class File:
             outputs,
         )
     
+    def clone(
+        self,
+        to: str,
+        hardlink: bool = True,
+        outputs: cli.Outputs = {'out': False, 'err': True}
+    ) -> bool:
+        return clone(
+            self.path,
+            to,
+            hardlink,
+            outputs,
+        )
+
     def remove(
         self,
         outputs: cli.Outputs = {'out': False, 'err': True}
@@ -1,11 +1,31 @@
-import json
+import os, json, tempfile
+
+FILE_MODE = 0o644
+
+def _sync_directory(directory: str) -> None:
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try: os.fsync(directory_fd)
+    finally: os.close(directory_fd)
 
 def write(path: str, data: dict) -> bool:
+    directory, name = os.path.split(os.path.abspath(path))
+    temporary_path = None
+
     try:
-        with open(path, 'w') as file:
+        fd, temporary_path = tempfile.mkstemp(prefix=f'.{name}.', dir=directory)
+        os.fchmod(fd, FILE_MODE)
+
+        with os.fdopen(fd, 'w') as file:
             json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary_path, path)
+        _sync_directory(directory)
         return True
-    except IOError as e: print(e)
+    except IOError as e:
+        print(e)
+        if temporary_path and os.path.exists(temporary_path): os.remove(temporary_path)
     
     return False
 
@@ -0,0 +1,116 @@
+"""
+Author            : Nohavye
+Author's Email    : noha.poncelet@gmail.com
+Repository        : https://github.com/vixen-shell/vixen-environment.git
+Description       : vixen execution tracing tools.
+License           : GPL3
+"""
+
+import os, time, resource, threading
+from contextlib import contextmanager
+from typing import List
+from . import json
+
+def _children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class Span:
+    def __init__(self, name: str, category: str) -> None:
+        self.name = name
+        self.category = category
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.children_cpu_time = 0.0
+        self.bytes = 0
+        self._cpu_start = time.thread_time()
+        self._children_cpu_start = _children_cpu_time()
+
+    def close(self) -> None:
+        self.wall_time = time.perf_counter() - self.start
+        self.cpu_time = time.thread_time() - self._cpu_start
+        self.children_cpu_time = _children_cpu_time() - self._children_cpu_start
+
+class Tracer:
+    """Records the wall time, cpu time and bytes copied of each step.
+
+    The cpu time of child processes comes from RUSAGE_CHILDREN, so it is
+    only exact for steps which do not overlap with other commands.
+    """
+
+    def __init__(self) -> None:
+        self.profile = False
+        self._origin = time.perf_counter()
+        self._spans: List[Span] = []
+        self._active = threading.local()
+        self._lock = threading.Lock()
+
+    def _active_spans(self) -> List[Span]:
+        if not hasattr(self._active, 'spans'): self._active.spans = []
+        return self._active.spans
+
+    @contextmanager
+    def span(self, name: str, category: str):
+        span = Span(name, category)
+        self._active_spans().append(span)
+
+        try: yield span
+        finally:
+            span.close()
+            self._active_spans().remove(span)
+            self._spans.append(span)
+
+    def add_bytes(self, count: int) -> None:
+        with self._lock:
+            for span in self._active_spans(): span.bytes += count
+
+    def context(self) -> List[Span]:
+        return list(self._active_spans())
+
+    @contextmanager
+    def attach(self, spans: List[Span]):
+        """Counts the bytes of the current thread (a worker) in the spans
+        of the thread which handed it the work."""
+        previous = self._active_spans()
+        self._active.spans = list(spans)
+
+        try: yield
+        finally: self._active.spans = previous
+
+    def events(self) -> List[dict]:
+        return [
+            {
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - self._origin) * 1e6),
+                'dur': round(span.wall_time * 1e6),
+                'pid': os.getpid(),
+                'tid': span.thread_id,
+                'args': {
+                    'cpu_ms': round(span.cpu_time * 1e3, 3),
+                    'children_cpu_ms': round(span.children_cpu_time * 1e3, 3),
+                    'bytes': span.bytes
+                }
+            } for span in self._spans
+        ]
+
+    def write(self, path: str) -> bool:
+        return json.write(path, {'traceEvents': self.events(), 'displayTimeUnit': 'ms'})
+
+    def summary(self, limit: int = 10) -> str:
+        spans = sorted(self._spans, key=lambda span: span.wall_time, reverse=True)
+        lines = [f"{'wall (s)':>9} {'cpu (s)':>8} {'child cpu (s)':>14} {'bytes':>12}  step"]
+
+        for span in spans[:limit]:
+            lines.append(
+                f"{span.wall_time:>9.3f} {span.cpu_time:>8.3f} "
+                f"{span.children_cpu_time:>14.3f} {span.bytes:>12}  "
+                f"[{span.category}] {span.name}"
+            )
+
+        return '\n'.join(lines)
+
+tracer = Tracer()
@@ -10,37 +10,57 @@ Additional Information:
 """
 
 import os
+from vixen_lib.packages.wheels import WheelCache
+from vixen_lib.packages.venv import VenvTemplate
 
 CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
 
 feature = {
     'name': 'Vixen Environment',
+    'version': '0.0.1',
     'install_path': '/opt/vixen-env'
 }
-feature['install_command'] = f"python -m venv {feature['install_path']}"
+feature['install_callback'] = lambda: VenvTemplate('python').clone(feature['install_path'])
 feature['remove_command'] = f"rm -r {feature['install_path']}"
 
 library = {
     'name': 'vixen_lib',
-    'source': '/opt/vixen-env/bin/activate'
+    'source': '/opt/vixen-env/bin/activate',
+    'packages_path': f"{feature['install_path']}/lib"
+}
+
+def wheels_command(install_options: str) -> str:
+    wheels = WheelCache(library['name'], CURRENT_PATH)
+    return f"{wheels.build_command} && {wheels.install_command} {install_options}"
+
+# Built when the task runs: up to date, the source tree is never hashed.
+library['install_command'] = lambda: wheels_command('--no-compile')
+library['update_command'] = lambda: wheels_command('--no-compile --force-reinstall')
+
+bytecode = {
+    'paths': [f"{feature['install_path']}/lib"],
+    'python': f"{feature['install_path']}/bin/python",
+    'invalidation_mode': 'checked-hash'
 }
-library['install_command'] = f"source {library['source']} && pip install --upgrade pip && pip install {CURRENT_PATH}"
 
 executable = {
     'name': 'vxm',
     'install_path': '/usr/bin',
     'patch': '#!/opt/vixen-env/bin/python',
 }
+executable['path'] = f"{executable['install_path']}/{executable['name']}"
 executable['install_command'] = f"cp -f {CURRENT_PATH}/{executable['name']} {executable['install_path']}"
 executable['remove_command'] = f"rm {executable['install_path']}/{executable['name']}"
 executable['patch_command'] = f'sed -i "1s|.*|{executable["patch"]}|" {executable["install_path"]}/{executable["name"]}'
 
 setup = {
     'purpose': f"Install {feature['name']}",
+    'feature': {'name': feature['name'], 'version': feature['version']},
     'tasks': [
         {
             'purpose': 'Create the Vixen environment',
-            'process_command': feature['install_command'],
+            'process_callback': feature['install_callback'],
+            'provides': ['environment'],
             'requirements': [
                 {
                     'purpose': f"Check {feature['name']} is not already installed",
@@ -51,33 +71,58 @@ setup = {
         },
         {
             'purpose': f"Install {library['name']} library",
-            'process_command': library['install_command']
+            'name': 'library',
+            'inputs': [CURRENT_PATH],
+            'outputs': [library['packages_path']],
+            'process_command': library['install_command'],
+            'source': library['source'],
+            'depends_on': ['environment'],
+            'provides': ['library']
         },
         {
             'purpose': 'Remove build folders',
-            'process_command': f"rm -r {CURRENT_PATH}/build && rm -r {CURRENT_PATH}/{library['name']}.egg-info",
+            'name': 'build_folders',
+            'inputs': [CURRENT_PATH],
+            'process_command': f"rm -rf {CURRENT_PATH}/build {CURRENT_PATH}/{library['name']}.egg-info",
+            'depends_on': ['library']
         },
         {
             'purpose': 'Install Vixen Manager executable',
+            'name': 'executable',
+            'inputs': [f"{CURRENT_PATH}/{executable['name']}"],
+            'outputs': [executable['path']],
             'process_command': executable['install_command'],
+            'depends_on': ['environment'],
+            'provides': ['executable']
         },
         {
             'purpose': 'Patch Vixen Manager executable',
-            'process_command': executable['patch_command']
+            'name': 'executable_patch',
+            'inputs': [executable['path']],
+            'process_command': executable['patch_command'],
+            'depends_on': ['executable']
         }
     ],
+    'compile': bytecode,
     'state': {
         'env_path': feature['install_path'],
-        'exec_paths': [f"{executable['install_path']}/{executable['name']}"]
+        'exec_paths': [executable['path']]
     }
 }
 
 update = {
     'purpose': f"Update {feature['name']}",
+    'feature': {'name': feature['name'], 'version': feature['version']},
+    'compile': bytecode,
     'tasks': [
         {
             'purpose': f"Update {library['name']} library",
-            'process_command': f"{library['install_command']} --force-reinstall",
+            'name': 'library',
+            'inputs': [CURRENT_PATH],
+            'outputs': [library['packages_path']],
+            'process_command': library['update_command'],
+            'source': library['source'],
+            'provides': ['library'],
             'requirements': [
                 {
                     'purpose': 'Check an existing installation',
@@ -88,15 +133,26 @@ update = {
         },
         {
             'purpose': 'Remove build folders',
-            'process_command': f"rm -r {CURRENT_PATH}/build && rm -r {CURRENT_PATH}/{library['name']}.egg-info",
+            'name': 'build_folders',
+            'inputs': [CURRENT_PATH],
+            'process_command': f"rm -rf {CURRENT_PATH}/build {CURRENT_PATH}/{library['name']}.egg-info",
+            'depends_on': ['library']
         },
         {
             'purpose': 'Update Vixen Manager executable',
+            'name': 'executable',
+            'inputs': [f"{CURRENT_PATH}/{executable['name']}"],
+            'outputs': [executable['path']],
             'process_command': executable['install_command'],
+            'depends_on': ['library'],
+            'provides': ['executable']
         },
         {
             'purpose': 'Patch Vixen Manager executable',
-            'process_command': executable['patch_command']
+            'name': 'executable_patch',
+            'inputs': [executable['path']],
+            'process_command': executable['patch_command'],
+            'depends_on': ['executable']
         }
     ]
 }
\ No newline at end of file